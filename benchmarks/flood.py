@@ -0,0 +1,229 @@
+"""Normal users' latency while a few abusive chats flood the bot, with and without admission control.
+
+Paced synthetic users go through the load test's scenarios, a message every `--think` seconds,
+while `--abusers` chats each send `--abuse-rate` messages per second, partly the same text
+over and over. Updates go through the dispatcher thread, or the worker pool, against the fake
+Bot API in real time. Each run reports the normal users' update and reply latency, the plans they
+completed and what admission control (AdmissionControl) let through, held back and dropped, and
+checks that each normal user's updates, held ones included, were handled in the order sent.
+
+Usage:
+    python benchmarks/flood.py --users 200 --abusers 5 --abuse-rate 500 --admission off on --mode sync pool \
+        --output flood.json
+"""
+import argparse
+import bisect
+import datetime
+import json
+import platform
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from queue import Queue
+
+from telegram import Chat, Message, MessageEntity, Update, User
+from telegram.ext import Dispatcher, JobQueue
+
+from load_test import SCENARIOS, FakeBot, Histogram, load_bot
+
+ABUSER_CHAT_BASE = 10_000_000
+
+
+class TrackingDispatcher(Dispatcher):
+    """Dispatcher that records when the last processing of each update started and finished.
+
+    An update held back by admission control is processed twice; the second time is the one that counts.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = {}
+        self.finished = {}
+        self.threads = {}
+
+    def process_update(self, update):
+        started = time.perf_counter()
+        try:
+            super().process_update(update)
+        finally:
+            if isinstance(update, Update):
+                self.started[update.update_id] = started
+                self.finished[update.update_id] = time.perf_counter()
+                self.threads[update.update_id] = threading.current_thread().name
+
+
+def make_update(bot, update_id, chat_id, text):
+    entities = [MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text.split()[0]))] if text.startswith("/") else []
+    message = Message(update_id, datetime.datetime.now(), Chat(chat_id, Chat.PRIVATE),
+                      from_user=User(chat_id, "user", False), text=text, entities=entities, bot=bot)
+    return Update(update_id, message=message)
+
+
+def build_traffic(bot, users, abusers, abuse_rate, repeat_share, duration, think, seed):
+    """(send at, update) pairs sorted by time, and the number of plans the normal users complete."""
+    rng = random.Random(seed)
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[name][0] for name in names]
+    events = []
+    expected_plans = 0
+    update_ids = iter(range(1, 1 << 62))
+    for chat_id in range(1, users + 1):
+        name = rng.choices(names, weights)[0]
+        expected_plans += SCENARIOS[name][2]
+        at = rng.uniform(0, duration / 2)
+        for text in SCENARIOS[name][1]:
+            events.append((at, make_update(bot, next(update_ids), chat_id, text)))
+            at += rng.uniform(*think)
+    for chat_id in range(ABUSER_CHAT_BASE, ABUSER_CHAT_BASE + abusers):
+        events.append((0.0, make_update(bot, next(update_ids), chat_id, "/start")))
+        for i in range(int(duration * abuse_rate)):
+            text = "hello" if rng.random() < repeat_share else f"spam {rng.getrandbits(32)}"
+            events.append(((i + rng.random()) / abuse_rate, make_update(bot, next(update_ids), chat_id, text)))
+    events.sort(key=lambda event: event[0])
+    return events, expected_plans
+
+
+def run(bot_module, mode, admission, events, expected_plans, args):
+    bot = FakeBot(args.bot_latency / 1000)
+    bot_module.init_services(bot, profile_db_path=None, reminder_db_path=None, weight_db_path=None, tip_db_path=None,
+                             metrics_sample_rate=None, admission_rate=bot_module.ADMISSION_USER_RATE if admission else None,
+                             global_rate=args.global_rate)
+    job_queue = JobQueue()
+    dispatcher = TrackingDispatcher(bot, Queue(), workers=1, job_queue=job_queue)
+    job_queue.set_dispatcher(dispatcher)
+    bot_module.register_handlers(dispatcher)
+    bot_module.schedule_jobs(job_queue)
+    job_queue.start()
+    bot_module.message_sender.start()
+    if mode == "sync":
+        threading.Thread(target=dispatcher.start, name="dispatcher", daemon=True).start()
+        submit = dispatcher.update_queue.put
+    else:
+        # Room for every update, as the dispatcher's queue has in sync mode, so the flood is never turned away here
+        pool = bot_module.UpdateWorkerPool(dispatcher, queue_size=len(events) * bot_module.WEBHOOK_WORKERS)
+        bot_module.release_updates_to(pool.put)
+        pool.start()
+        submit = pool.put
+
+    submitted = {}
+    started = time.perf_counter()
+    for at, update in events:
+        delay = started + at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        submitted[update.update_id] = time.perf_counter()
+        submit(update)
+    normal = [update for _, update in events if update.effective_chat.id < ABUSER_CHAT_BASE]
+
+    # Give the normal users' last messages time to be handled and answered, abusive ones may never be
+    deadline = time.perf_counter() + args.grace
+    while time.perf_counter() < deadline and not all(update.update_id in dispatcher.finished for update in normal):
+        time.sleep(0.01)
+    time.sleep(min(1.0, max(0.0, deadline - time.perf_counter())))
+    calls = list(bot.calls)
+    sender_stats = bot_module.message_sender.stats()
+    admission_stats = bot_module.admission_control.stats() if bot_module.admission_control else None
+    plans = sum(1 for chat_id in bot_module.reminder_scheduler.due_times() if chat_id < ABUSER_CHAT_BASE)
+    # Abandon the flood still queued. Without admission control the dispatcher may be waiting for room
+    # in the full send queue; lifting the limit lets it finish its update and stop
+    job_queue.stop()
+    bot_module.message_sender.max_size = float("inf")
+    if mode == "sync":
+        while not dispatcher.update_queue.empty():
+            dispatcher.update_queue.get_nowait()
+        bot_module.message_sender.stop(timeout=0)
+        dispatcher.stop()
+    else:
+        bot_module.message_sender.stop(timeout=0)
+        pool.stop()  # Works through the flood still queued, a few seconds at most
+
+    # Held updates go back through the ingestion path: each chat's updates are handled in order, never by the JobQueue
+    by_chat = defaultdict(list)
+    for update in normal:
+        if update.update_id in dispatcher.started:
+            by_chat[update.effective_chat.id].append(update.update_id)
+    for chat_id, update_ids in by_chat.items():
+        assert sorted(update_ids, key=dispatcher.started.get) == update_ids, f"chat {chat_id} handled out of order"
+    job_threads = sum(1 for name in dispatcher.threads.values() if not name.startswith(("dispatcher", "update-worker")))
+
+    replies = defaultdict(list)
+    for at, chat_id, _ in calls:
+        replies[chat_id].append(at)
+    update_latency = Histogram()
+    reply_latency = Histogram()
+    unanswered = 0
+    for update in normal:
+        update_id = update.update_id
+        if update_id not in dispatcher.finished:
+            unanswered += 1
+            continue
+        update_latency.add(dispatcher.finished[update_id] - submitted[update_id])
+        chat_replies = replies[update.effective_chat.id]
+        i = bisect.bisect_left(chat_replies, dispatcher.started[update_id])
+        if i < len(chat_replies):
+            reply_latency.add(chat_replies[i] - submitted[update_id])
+        else:
+            unanswered += 1
+    return {
+        "mode": mode,
+        "admission": admission,
+        "normal_updates": len(normal),
+        "normal_unanswered": unanswered,
+        "normal_update_latency": update_latency.summary(),
+        "normal_reply_latency": reply_latency.summary(),
+        "completed_plans": plans,
+        "expected_plans": expected_plans,
+        "abusive_updates": len(events) - len(normal),
+        "abusive_replies": sum(1 for _, chat_id, _ in calls if chat_id >= ABUSER_CHAT_BASE),
+        "updates_handled_by_job_queue": job_threads,
+        "admission_control": admission_stats,
+        "sender": sender_stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200, help="normal users")
+    parser.add_argument("--abusers", type=int, default=5, help="flooding chats")
+    parser.add_argument("--abuse-rate", type=float, default=500, help="messages/sec from each flooding chat")
+    parser.add_argument("--repeat-share", type=float, default=0.5, help="fraction of flood messages repeating one text")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of flooding")
+    parser.add_argument("--think", type=float, nargs=2, default=[1.0, 3.0], help="seconds between a user's messages")
+    parser.add_argument("--grace", type=float, default=15, help="seconds to wait for the normal users afterwards")
+    parser.add_argument("--global-rate", type=float, default=1000,
+                        help="sender messages/sec (Telegram allows ~30; higher keeps the run short)")
+    parser.add_argument("--admission", nargs="+", choices=["off", "on"], default=["off", "on"])
+    parser.add_argument("--mode", nargs="+", choices=["sync", "pool"], default=["sync"],
+                        help="sync: dispatcher thread, pool: UpdateWorkerPool")
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="simulated Bot API round-trip in ms")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    bot_module = load_bot()
+    results = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "users": args.users,
+        "abusers": args.abusers,
+        "abuse_rate": args.abuse_rate,
+        "duration_s": args.duration,
+        "runs": [],
+    }
+    events, expected_plans = build_traffic(FakeBot(), args.users, args.abusers, args.abuse_rate, args.repeat_share,
+                                           args.duration, args.think, args.seed)
+    for mode in args.mode:
+        for admission in args.admission:
+            results["runs"].append(run(bot_module, mode, admission == "on", events, expected_plans, args))
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
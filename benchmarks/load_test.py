@@ -0,0 +1,342 @@
+"""Load test for the Calorie Compass conversation, run against a local fake Bot API.
+
+Drives the real `conversation_handler` with synthetic users going through full onboarding,
+invalid input that ends in `ask_restart`, `/cancel` and `/plan`, and reports updates/sec,
+per-handler latency histograms, Bot API calls per completed plan and memory growth. With metrics
+on, also times the same updates with and without instrumentation and checks the cost per update
+stays within METRICS_OVERHEAD_BUDGET_US.
+
+Usage:
+    python benchmarks/load_test.py --users 2000 --mode sync pool --output results.json
+    python benchmarks/load_test.py --metrics off full sampled   # also checks the instrumentation overhead per update
+"""
+import argparse
+import datetime
+import gc
+import gc
+import importlib.util
+import itertools
+import json
+import platform
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from queue import Queue
+
+from telegram import Chat, Message, MessageEntity, Update, User
+from telegram.ext import ConversationHandler, Dispatcher
+
+BOT_PATH = Path(__file__).resolve().parent.parent / "calorie-compass.py"
+METRICS_SAMPLE_RATES = {"off": None, "full": 1.0, "sampled": 0.01}
+METRICS_OVERHEAD_BUDGET_US = {"full": 25, "sampled": 15}  # CPU per update; measured at about 10 and 7
+LATENCY_BUCKETS_MS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+# (weight, steps, completes a plan)
+SCENARIOS = {
+    "onboarding_en": (35, ["/start", "English", "30", "Male", "180", "80", "Moderately Active", "0.5"], True),
+    "onboarding_ru": (25, ["/start", "Русский", "35", "Женский", "165", "60", "Малоактивный", "0.4"], True),
+    "invalid_restart": (15, ["/start", "English", "abc", "5", "999", "Start Over",
+                             "English", "28", "Female", "170", "65", "Sedentary", "0.3"], True),
+    "cancel": (15, ["/start", "English", "40", "Male", "/cancel"], False),
+    "plan": (10, ["/plan 30 m 180 80 moderate 0.5"], True),
+}
+
+
+def load_bot():
+    """Import calorie-compass.py as a module; importing it has no side effects."""
+    spec = importlib.util.spec_from_file_location("calorie_compass", BOT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeBot:
+    """Stands in for telegram.Bot: records every send_message call, optionally with a simulated round-trip."""
+
+    def __init__(self, latency=0.0):
+        self.id = 1
+        self.username = "calorie_compass_bot"
+        self.first_name = "Calorie Compass"
+        self.defaults = None
+        self.latency = latency
+        self.calls = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        self.calls.append((time.perf_counter(), chat_id, text))
+
+
+class TimedDispatcher(Dispatcher):
+    """Dispatcher that records when each update finishes processing."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.enqueued = {}
+        self.latencies = []
+        self.done = threading.Semaphore(0)
+
+    def process_update(self, update):
+        try:
+            super().process_update(update)
+        finally:
+            if isinstance(update, Update):
+                self.latencies.append(time.perf_counter() - self.enqueued.pop(update.update_id))
+                self.done.release()
+
+
+class Histogram:
+    def __init__(self):
+        self.samples = []
+
+    def add(self, seconds):
+        self.samples.append(seconds * 1000)
+
+    def summary(self) -> dict:
+        samples = sorted(self.samples)
+        if not samples:
+            return {"count": 0}
+        buckets = {f"le_{bound}": 0 for bound in LATENCY_BUCKETS_MS}
+        buckets["le_inf"] = 0
+        for sample in samples:
+            bound = next((bound for bound in LATENCY_BUCKETS_MS if sample <= bound), None)
+            buckets[f"le_{bound}" if bound is not None else "le_inf"] += 1
+
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(p / 100 * len(samples)))], 4)
+
+        return {
+            "count": len(samples),
+            "p50_ms": percentile(50),
+            "p90_ms": percentile(90),
+            "p99_ms": percentile(99),
+            "max_ms": round(samples[-1], 4),
+            "mean_ms": round(sum(samples) / len(samples), 4),
+            "buckets": buckets,
+        }
+
+
+def instrument_handlers(dispatcher, histograms):
+    """Wrap every registered handler callback, including each conversation state's, to time it.
+
+    Latencies are keyed by callback name. Returns (handler, original callback) pairs so the
+    wrapping can be undone.
+    """
+    handlers = []
+    for group in dispatcher.handlers.values():
+        for handler in group:
+            if isinstance(handler, ConversationHandler):
+                handlers.extend(handler.entry_points)
+                handlers.extend(handler.fallbacks)
+                for state_handlers in handler.states.values():
+                    handlers.extend(state_handlers)
+            else:
+                handlers.append(handler)
+
+    def timed(callback, histogram):
+        def wrapper(update, context):
+            start = time.perf_counter()
+            try:
+                return callback(update, context)
+            finally:
+                histogram.add(time.perf_counter() - start)
+        return wrapper
+
+    originals = [(state_handler, state_handler.callback) for state_handler in handlers]
+    for state_handler, callback in originals:
+        state_handler.callback = timed(callback, histograms.setdefault(callback.__name__, Histogram()))
+    return originals
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def build_updates(bot, users, first_chat_id, seed):
+    """Interleave the users' messages the way concurrent users would send them; each user's order is kept."""
+    rng = random.Random(seed)
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[name][0] for name in names]
+    scripts = []
+    expected_plans = 0
+    for chat_id in range(first_chat_id, first_chat_id + users):
+        name = rng.choices(names, weights)[0]
+        scripts.append((chat_id, iter(SCENARIOS[name][1])))
+        expected_plans += SCENARIOS[name][2]
+
+    message_ids = itertools.count(1)
+    updates = []
+    while scripts:
+        rng.shuffle(scripts)
+        remaining = []
+        for chat_id, steps in scripts:
+            text = next(steps, None)
+            if text is None:
+                continue
+            entities = [MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text.split()[0]))] if text.startswith("/") else []
+            message = Message(next(message_ids), datetime.datetime.now(), Chat(chat_id, Chat.PRIVATE),
+                              from_user=User(chat_id, "user", False), text=text, entities=entities, bot=bot)
+            updates.append(Update(message.message_id, message=message))
+            remaining.append((chat_id, steps))
+        scripts = remaining
+    return updates, expected_plans
+
+
+def run(bot_module, mode, metrics, users, bot_latency, first_chat_id, seed):
+    bot = FakeBot(bot_latency)
+    bot_module.init_services(bot, profile_db_path=None, reminder_db_path=None, weight_db_path=None, tip_db_path=None,
+                             metrics_sample_rate=METRICS_SAMPLE_RATES[metrics], admission_rate=None,
+                             global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+    dispatcher = TimedDispatcher(bot, Queue(), workers=1)
+    bot_module.register_handlers(dispatcher)
+    histograms = {}
+    handlers = instrument_handlers(dispatcher, histograms)
+    updates, expected_plans = build_updates(bot, users, first_chat_id, seed)
+
+    if mode == "sync":
+        runner = threading.Thread(target=dispatcher.start, daemon=True)
+        runner.start()
+        submit = dispatcher.update_queue.put
+    else:
+        runner = bot_module.UpdateWorkerPool(dispatcher)
+        runner.start()
+
+        def submit(update):
+            while not runner.submit(update):  # Full queue: retry later, as Telegram does after a 503
+                time.sleep(0.001)
+
+    rss_before = rss_bytes()
+    bot_module.message_sender.start()
+    started = time.perf_counter()
+    for update in updates:
+        dispatcher.enqueued[update.update_id] = time.perf_counter()
+        submit(update)
+    for _ in updates:
+        dispatcher.done.acquire()
+    elapsed = time.perf_counter() - started
+    bot_module.message_sender.stop()
+    rss_after = rss_bytes()
+
+    if mode == "sync":
+        dispatcher.stop()
+    else:
+        runner.stop()
+    for state_handler, callback in handlers:  # Unwrap so the next run starts from the plain callbacks
+        state_handler.callback = callback
+
+    update_latency = Histogram()
+    for latency in dispatcher.latencies:
+        update_latency.add(latency)
+    plans = len(bot_module.reminder_scheduler)
+    return {
+        "mode": mode,
+        "metrics": metrics,
+        "users": users,
+        "updates": len(updates),
+        "elapsed_s": round(elapsed, 4),
+        "updates_per_sec": round(len(updates) / elapsed, 1),
+        "completed_plans": plans,
+        "expected_plans": expected_plans,
+        "bot_api_calls": len(bot.calls),
+        "bot_api_calls_per_plan": round(len(bot.calls) / plans, 2) if plans else None,
+        "update_latency": update_latency.summary(),
+        "handler_latency": {name: histogram.summary() for name, histogram in sorted(histograms.items())},
+        "rss_growth_bytes": rss_after - rss_before,
+        "rss_growth_per_user_bytes": round((rss_after - rss_before) / users, 1),
+        "profiles": len(bot_module.profile_store),
+        "sender": bot_module.message_sender.stats(),
+    }
+
+
+def time_stream(bot_module, bot, updates, metrics) -> float:
+    """CPU seconds to handle `updates` from a fresh start with the given instrumentation, replies sent included.
+
+    CPU time of the whole process counts the sender threads' Bot API calls but not their waiting.
+    """
+    bot.calls.clear()
+    bot_module.init_services(bot, profile_db_path=None, reminder_db_path=None, weight_db_path=None, tip_db_path=None,
+                             metrics_sample_rate=METRICS_SAMPLE_RATES[metrics], admission_rate=None,
+                             global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+    dispatcher = Dispatcher(bot, Queue(), workers=1)
+    bot_module.register_handlers(dispatcher)
+    bot_module.message_sender.start()
+    gc.collect()
+    started = time.process_time()
+    for update in updates:
+        dispatcher.process_update(update)
+    bot_module.message_sender.join()
+    elapsed = time.process_time() - started
+    bot_module.message_sender.stop()
+    dispatcher.stop()
+    return elapsed
+
+
+def metrics_overhead(bot_module, users, repeats, seed=1) -> dict:
+    """Instrumentation cost in us per update for each metrics mode, against the same updates without metrics.
+
+    Every repeat handles the same update stream once per mode, back to back; the median of the
+    per-repeat differences keeps drift and noise between runs out of the result.
+    """
+    bot = FakeBot()
+    updates, _ = build_updates(bot, users, 1, seed)
+    differences = {metrics: [] for metrics in METRICS_SAMPLE_RATES if metrics != "off"}
+    for _ in range(repeats):
+        baseline = time_stream(bot_module, bot, updates, "off")
+        for metrics, samples in differences.items():
+            samples.append((time_stream(bot_module, bot, updates, metrics) - baseline) / len(updates) * 1e6)
+    return {metrics: round(statistics.median(samples), 2) for metrics, samples in differences.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000, help="synthetic users per run")
+    parser.add_argument("--mode", nargs="+", choices=["sync", "pool"], default=["sync"],
+                        help="sync: dispatcher thread, pool: UpdateWorkerPool, as in webhook and pool mode")
+    parser.add_argument("--metrics", nargs="+", choices=list(METRICS_SAMPLE_RATES), default=["off"],
+                        help="bot instrumentation: off, full (every call timed) or sampled (1 in 100 timed)")
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="simulated Bot API round-trip in ms")
+    parser.add_argument("--overhead-users", type=int, default=500, help="users in the stream timed for metrics overhead")
+    parser.add_argument("--overhead-repeats", type=int, default=11, help="times the stream is handled per metrics mode")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    bot_module = load_bot()
+    results = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "bot_latency_ms": args.bot_latency,
+        "runs": [],
+    }
+    runs = [(mode, metrics) for mode in args.mode for metrics in args.metrics]
+    for i, (mode, metrics) in enumerate(runs):
+        # Each run gets its own chat ids so conversation state from earlier runs does not carry over
+        results["runs"].append(run(bot_module, mode, metrics, args.users, args.bot_latency / 1000,
+                                   first_chat_id=1 + i * args.users, seed=args.seed))
+
+    if set(args.metrics) != {"off"}:
+        results["metrics_overhead_us_per_update"] = metrics_overhead(bot_module, args.overhead_users,
+                                                                     args.overhead_repeats, seed=args.seed)
+        results["metrics_overhead_budget_us"] = METRICS_OVERHEAD_BUDGET_US
+
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+    for metrics, us in results.get("metrics_overhead_us_per_update", {}).items():
+        assert us <= METRICS_OVERHEAD_BUDGET_US[metrics], f"{metrics} metrics cost {us} us per update"
+
+
+if __name__ == "__main__":
+    sys.exit(main())
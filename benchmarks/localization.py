@@ -0,0 +1,101 @@
+"""Per-message localization work in the handlers: building keyboards and matching input, before and after Locale.
+
+Before Locale, a handler built a ReplyKeyboardMarkup for every prompt with a keyboard, which the Bot
+serialized to JSON when sending, and matched the user's choice by scanning a list of labels for the
+user's language. A Locale serializes each keyboard once at startup and matches input with one dict
+lookup. For every prompt with a keyboard and every choice the user types, this times both ways in
+each language and checks that they produce the same keyboard and the same canonical value.
+
+Usage:
+    python benchmarks/localization.py --calls 100000 --output localization.json
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+from telegram import ReplyKeyboardMarkup
+
+from load_test import load_bot
+
+
+def per_call_us(function, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def keyboard_cases(bot_module, locale):
+    """(name, labels, precompiled keyboard) for each prompt that shows a keyboard."""
+    texts = locale.texts
+    return [
+        ("language", [[bot_module.LOCALES[code]["language_name"] for code in bot_module.LANGUAGES]],
+         bot_module.LANGUAGE_KEYBOARD),
+        ("gender", [[texts["gender_options"][key] for key in row] for row in bot_module.GENDER_KEYBOARD_LAYOUT],
+         locale.keyboards["gender"]),
+        ("activity", [[texts["activity_options"][key] for key in row] for row in bot_module.ACTIVITY_KEYBOARD_LAYOUT],
+         locale.keyboards["activity"]),
+        ("restart", [[texts["restart_options"][key] for key in row] for row in bot_module.RESTART_KEYBOARD_LAYOUT],
+         locale.keyboards["restart"]),
+    ]
+
+
+def choice_cases(locale):
+    """(name, options by canonical value, lookup, typed text) for each choice; the last option is the slowest to scan."""
+    texts = locale.texts
+    return [(name, texts[key], lookup, list(texts[key].values())[-1].upper())
+            for name, key, lookup in (("gender", "gender_options", locale.genders),
+                                      ("activity", "activity_options", locale.activities),
+                                      ("restart", "restart_options", locale.restart_choices))]
+
+
+def scan(options, text):
+    """Match the way the handlers did: the lower-cased text against each label in turn."""
+    text = text.lower()
+    for key, label in options.items():
+        if text == label.lower():
+            return key
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100_000, help="calls timed per case")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    bot_module = load_bot()
+    bot_module.load_localization()
+    results = {"calls": args.calls, "languages": {}}
+    for code, locale in bot_module.LOCALES.items():
+        cases = {}
+        for name, labels, keyboard in keyboard_cases(bot_module, locale):
+            def before():
+                return ReplyKeyboardMarkup(labels, one_time_keyboard=True, resize_keyboard=True).to_json()
+
+            def after():
+                return locale.keyboards.get(name, keyboard)
+
+            assert json.loads(before()) == json.loads(after()), (code, name)
+            cases[f"{name}_keyboard"] = {"before_us": round(per_call_us(before, args.calls), 3),
+                                         "after_us": round(per_call_us(after, args.calls), 3)}
+        for name, options, lookup, text in choice_cases(locale):
+            assert scan(options, text) == lookup.get(bot_module.normalize_input(text)) is not None, (code, name)
+            cases[f"{name}_choice"] = {
+                "before_us": round(per_call_us(lambda: scan(options, text), args.calls), 3),
+                "after_us": round(per_call_us(lambda: lookup.get(bot_module.normalize_input(text)), args.calls), 3),
+            }
+        for case in cases.values():
+            case["speedup"] = round(case["before_us"] / case["after_us"], 1)
+        results["languages"][code] = cases
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Calorie plans for many profiles at once: a Python loop against calculate_plan_batch.
+
+Builds `--profiles` random profiles, with some activity levels in other letter cases or unknown,
+and times the original per-profile formulas in a loop, calculate_plan_batch given the columns as
+lists, as arrays and as arrays with indexes into ACTIVITY_LEVELS for the activity levels, and the
+one-profile calculate_plan the handlers use.
+Checks that every result matches the loop exactly, not just approximately.
+
+Usage:
+    python benchmarks/plan_batch.py --profiles 1000000 --output plan_batch.json
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from load_test import load_bot
+
+
+def scalar_plan(age, gender, weight, height, activity_level, weight_loss_goal):
+    """The bot's formulas before the batch engine, one profile at a time."""
+    if gender == 'male':
+        bmr = 88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age)
+    else:
+        bmr = 447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age)
+    activity_factors = {
+        'sedentary': 1.2,
+        'lightly active': 1.375,
+        'moderately active': 1.55,
+        'very active': 1.725,
+        'super active': 1.9
+    }
+    tdee = bmr * activity_factors.get(activity_level.lower(), 1.2)
+    return tdee, tdee - (weight_loss_goal * 7700) / 7
+
+
+def build_profiles(bot_module, count, seed):
+    rng = random.Random(seed)
+    levels = list(bot_module.ACTIVITY_LEVELS)
+    names = levels + [level.title() for level in levels] + ["couch potato"]
+    codes = [rng.randrange(len(levels)) for _ in range(count)]
+    return {
+        "age": [rng.randint(10, 120) for _ in range(count)],
+        "gender": [rng.choice(("male", "female")) for _ in range(count)],
+        "weight": [rng.uniform(30, 180) for _ in range(count)],
+        "height": [rng.uniform(50, 250) for _ in range(count)],
+        # Nearly all names come from the keyboard; a few are typed in another case or unknown
+        "activity_level": [levels[code] if rng.random() < 0.99 else rng.choice(names) for code in codes],
+        "activity_code": codes,
+        "weight_loss_goal": [rng.choice((0.25, 0.5, 0.75, 1.0)) for _ in range(count)],
+    }
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", type=int, default=1_000_000)
+    parser.add_argument("--single", type=int, default=10_000, help="profiles run through calculate_plan one by one")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    bot_module = load_bot()
+    profiles = build_profiles(bot_module, args.profiles, args.seed)
+    columns = [profiles[name] for name in bot_module.PLAN_FIELDS]
+    bot_module.calculate_plan_batch(*[column[:1] for column in columns])  # Import numpy outside the timings
+
+    loop, loop_seconds = timed(lambda: [scalar_plan(*profile) for profile in zip(*columns)])
+    loop_tdee = np.array([tdee for tdee, _ in loop])
+    loop_calories = np.array([calories for _, calories in loop])
+
+    (tdee, calories), names_seconds = timed(bot_module.calculate_plan_batch, *columns)
+    assert np.array_equal(tdee, loop_tdee) and np.array_equal(calories, loop_calories), "batch (names) differs"
+
+    # Columns already held as arrays skip the conversion from lists
+    arrays = [np.array(column) for column in columns]
+    (tdee, calories), arrays_seconds = timed(bot_module.calculate_plan_batch, *arrays)
+    assert np.array_equal(tdee, loop_tdee) and np.array_equal(calories, loop_calories), "batch (arrays) differs"
+
+    # Integer codes cannot express the odd names, so compare against the loop over the keyboard names
+    levels = bot_module.ACTIVITY_LEVELS
+    coded = arrays[:4] + [np.array(profiles["activity_code"]), arrays[5]]
+    (tdee, calories), codes_seconds = timed(bot_module.calculate_plan_batch, *coded)
+    expected = [scalar_plan(*profile[:4], levels[code], profile[5]) for profile, code
+                in zip(zip(*columns), profiles["activity_code"])]
+    assert np.array_equal(tdee, [t for t, _ in expected]) and np.array_equal(calories, [c for _, c in expected]), \
+        "batch (codes) differs"
+
+    single = min(args.single, args.profiles)
+    single_profiles = [bot_module.UserProfile(**dict(zip(bot_module.PLAN_FIELDS, profile)))
+                       for profile in zip(*[column[:single] for column in columns])]
+    # Best of a few rounds: a garbage collection over the million profiles above can land in any one of them
+    rounds = [timed(lambda: [bot_module.calculate_plan(profile) for profile in single_profiles]) for _ in range(5)]
+    plans, single_seconds = rounds[0][0], min(seconds for _, seconds in rounds)
+    assert plans == loop[:single], "calculate_plan differs"
+
+    results = {
+        "profiles": args.profiles,
+        "loop_s": round(loop_seconds, 3),
+        "batch_lists_s": round(names_seconds, 3),
+        "batch_arrays_s": round(arrays_seconds, 3),
+        "batch_arrays_codes_s": round(codes_seconds, 3),
+        "speedup_lists": round(loop_seconds / names_seconds, 1),
+        "speedup_arrays": round(loop_seconds / arrays_seconds, 1),
+        "speedup_arrays_codes": round(loop_seconds / codes_seconds, 1),
+        "loop_per_profile_us": round(loop_seconds / args.profiles * 1e6, 3),
+        "calculate_plan_us": round(single_seconds / single * 1e6, 3),
+        "matches_loop": True,
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""Updates and Bot API calls per completed plan: /plan against the step-by-step conversation, in every language.
+
+For each language and a grid of profiles, one chat answers the conversation's prompts with the
+keyboard labels, one sends /plan with the same values as short aliases ("m", "moderate") and one
+sends /plan with the full labels. Updates go through the real handlers against the fake Bot API.
+tests/test_plan.py checks that all three end with the same profile, plan and reply.
+
+Usage:
+    python benchmarks/plan_command.py --output plan_command.json
+"""
+import argparse
+import itertools
+import json
+import sys
+from pathlib import Path
+from queue import Queue
+
+from telegram.ext import Dispatcher
+
+from flood import make_update
+from load_test import FakeBot, load_bot
+
+# (age, height, weight, weight loss goal) as typed, combined with every gender and activity level
+MEASUREMENTS = [("30", "180", "80", "0.5"), ("17", "152.5", "48.2", "0.25"), ("64", "171", "96.4", "1")]
+
+
+def aliases(options, alias_map):
+    """The shortest thing a user may type for each canonical value: an alias if there is one, else the label."""
+    shortest = dict(options)
+    for alias, key in alias_map.items():
+        if len(alias) < len(shortest[key]):
+            shortest[key] = alias
+    return shortest
+
+
+def scripts(locale, measurements):
+    """(step-by-step texts, /plan with aliases, /plan with labels) for each combination of the profile values."""
+    texts = locale.texts
+    short_genders = aliases(texts["gender_options"], texts["gender_aliases"])
+    short_activities = aliases(texts["activity_options"], texts["activity_aliases"])
+    for (age, height, weight, goal), gender, activity in itertools.product(
+            measurements, texts["gender_options"], texts["activity_options"]):
+        gender_label, activity_label = texts["gender_options"][gender], texts["activity_options"][activity]
+        yield (["/start", texts["language_name"], age, gender_label, height, weight, activity_label, goal],
+               [f"/plan {age} {short_genders[gender]} {height} {weight} {short_activities[activity]} {goal}"],
+               [f"/plan {age} {gender_label} {height} {weight} {activity_label} {goal}"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    bot_module = load_bot()
+    bot = FakeBot()
+    bot_module.init_services(bot, profile_db_path=None, reminder_db_path=None, weight_db_path=None, tip_db_path=None,
+                             metrics_sample_rate=None, admission_rate=None,
+                             global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+    dispatcher = Dispatcher(bot, Queue(), workers=1)
+    bot_module.register_handlers(dispatcher)
+    bot_module.message_sender.start()
+
+    update_ids = itertools.count(1)
+    chat_ids = itertools.count(1)
+    runs = []  # (locale, [(user_id, update count)] for the step-by-step, alias and label ways)
+    for locale in bot_module.LOCALES.values():
+        for ways in scripts(locale, MEASUREMENTS):
+            users = []
+            for texts in ways:
+                user_id = next(chat_ids)
+                for text in texts:
+                    dispatcher.process_update(make_update(bot, next(update_ids), user_id, text))
+                users.append((user_id, len(texts)))
+            runs.append((locale, users))
+    bot_module.message_sender.join()
+    bot_module.message_sender.stop()
+
+    calls = {}
+    for _, chat_id, _ in bot.calls:
+        calls[chat_id] = calls.get(chat_id, 0) + 1
+    results = {"languages": {}}
+    for locale, users in runs:
+        language = results["languages"].setdefault(locale.code, {"plans": 0, "step_by_step": [0, 0], "plan": [0, 0]})
+        language["plans"] += 1
+        for way, (user_id, updates) in zip(("step_by_step", "plan"), users):
+            language[way][0] += updates
+            language[way][1] += calls[user_id]
+    for language in results["languages"].values():
+        for way in ("step_by_step", "plan"):
+            updates, bot_calls = language.pop(way)
+            language[way] = {"updates_per_plan": updates / language["plans"],
+                             "bot_api_calls_per_plan": bot_calls / language["plans"]}
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Memory and access cost of the profile stores (MemoryProfileStore, SQLiteProfileStore).
+
+Fills each store with `--profiles` complete profiles and reports the memory they hold per 100k
+profiles (traced Python allocations), put and cached get time, with the SQLite store's batched
+commits included in its puts, and the cold-read time after reopening the SQLite file. Before
+timing, checks that a flush running while a handler changes a profile, e.g. the periodic one,
+does not lose the change.
+
+Usage:
+    python benchmarks/profile_store.py --profiles 100000 --output profiles.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+from load_test import load_bot
+
+
+def check_flush_during_handler(bot_module, path):
+    """A flush between get_user_data() and the handler's change must not leave the profile marked clean."""
+    bot_module.init_services(None, profile_db_path=path, reminder_db_path=None, weight_db_path=None, tip_db_path=None,
+                             metrics_sample_rate=None, admission_rate=None)
+
+    def handler(update, context):
+        user_data = bot_module.get_user_data(update)
+        bot_module.profile_store.flush()  # The periodic flush job, or a batch flush from another worker
+        user_data['age'] = 42
+
+    bot_module.saving_profiles(handler)(SimpleNamespace(effective_user=SimpleNamespace(id=1)), None)
+    bot_module.profile_store.put(1, bot_module.profile_store.get(1))  # Both in the table and queued
+    assert len(bot_module.profile_store) == 1, len(bot_module.profile_store)
+    bot_module.profile_store.close()
+    reopened = bot_module.SQLiteProfileStore(path)
+    assert reopened.get(1).age == 42, reopened.get(1)
+    reopened.close()
+    os.remove(path)
+
+
+def make_profile(bot_module, i):
+    return bot_module.UserProfile(language="en" if i % 3 else "ru", age=18 + i % 60, gender="male" if i % 2 else "female",
+                                  height=150.0 + i % 50, weight=50.0 + i % 70, activity_level="sedentary",
+                                  weight_loss_goal=0.5)
+
+
+def measure(bot_module, name, make_store, count):
+    tracemalloc.start()
+    store = make_store()
+    before = tracemalloc.get_traced_memory()[0]
+    for user_id in range(count):
+        store.put(user_id, make_profile(bot_module, user_id))
+    traced = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for user_id in range(count):
+        store.get(user_id)
+    get_seconds = time.perf_counter() - started
+    store.close()
+
+    started = time.perf_counter()
+    store = make_store()
+    for user_id in range(count):
+        store.put(user_id, make_profile(bot_module, user_id))
+    put_seconds = time.perf_counter() - started
+    store.close()
+    return {
+        "store": name,
+        "profiles": count,
+        "traced_bytes_per_100k": round(traced / count * 100_000),
+        "put_us": round(put_seconds / count * 1e6, 3),
+        "get_cached_us": round(get_seconds / count * 1e6, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", type=int, default=100_000)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    bot_module = load_bot()
+    results = {"profiles": args.profiles, "runs": []}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "profiles.db")
+        check_flush_during_handler(bot_module, path)
+        results["runs"].append(measure(bot_module, "memory", lambda: bot_module.MemoryProfileStore(args.profiles),
+                                       args.profiles))
+        results["runs"].append(measure(bot_module, "sqlite", lambda: bot_module.SQLiteProfileStore(
+            path, max_profiles=args.profiles), args.profiles))
+
+        # Cold reads: a fresh store over the file written above, nothing cached yet
+        store = bot_module.SQLiteProfileStore(path, max_profiles=args.profiles)
+        started = time.perf_counter()
+        for user_id in range(args.profiles):
+            store.get(user_id)
+        results["sqlite_cold_get_us"] = round((time.perf_counter() - started) / args.profiles * 1e6, 3)
+        store.close()
+        results["db_bytes_per_profile"] = round(os.path.getsize(path) / args.profiles, 1)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
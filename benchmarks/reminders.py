@@ -0,0 +1,105 @@
+"""Cost of the weekly progress reminders (ReminderScheduler) as the number of users grows.
+
+Schedules reminders for `--users` chats, each finishing its plan `--recalculations` times, and
+reports at each step the JobQueue job count, the scheduler's entries and the cost of an idle
+tick. Then times a week of ticks and reloading the due times from SQLite. tests/test_reminders.py
+checks that every chat gets exactly one reminder a week.
+
+Usage:
+    python benchmarks/reminders.py --users 100000 --output reminders.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from queue import Queue
+
+from telegram.ext import Dispatcher, JobQueue
+
+from load_test import FakeBot, load_bot
+
+
+def idle_tick_us(scheduler, now, ticks=10_000):
+    started = time.perf_counter()
+    for _ in range(ticks):
+        scheduler.pop_due(now)
+    return round((time.perf_counter() - started) / ticks * 1e6, 3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--recalculations", type=int, default=3, help="plans finished per user")
+    parser.add_argument("--steps", type=int, default=10, help="points at which the counts are reported")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    bot_module = load_bot()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "reminders.db")
+        bot = FakeBot()
+        bot_module.init_services(bot, profile_db_path=None, reminder_db_path=path, weight_db_path=None,
+                                 tip_db_path=None, metrics_sample_rate=None)
+        job_queue = JobQueue()
+        job_queue.set_dispatcher(Dispatcher(bot, Queue(), job_queue=job_queue))
+        bot_module.schedule_jobs(job_queue)
+        scheduler = bot_module.reminder_scheduler
+        interval = scheduler.interval
+
+        # Users finish their plans over one day; recalculating replaces the chat's reminder
+        now = 0.0
+        step = max(1, args.users // args.steps)
+        growth = []
+        for first in range(0, args.users, step):
+            started = time.perf_counter()
+            chats = range(first, min(first + step, args.users))
+            for _ in range(args.recalculations):
+                for chat_id in chats:
+                    now += 86400 / (args.users * args.recalculations)
+                    scheduler.schedule(chat_id, now=now)
+            schedule_seconds = time.perf_counter() - started
+            growth.append({
+                "users": chats.stop,
+                "jobs": len(job_queue.jobs()),
+                "reminders": len(scheduler),
+                "schedule_us": round(schedule_seconds / (len(chats) * args.recalculations) * 1e6, 3),
+                "idle_tick_us": idle_tick_us(scheduler, now),
+            })
+
+        # A week of ticks: every chat is reminded once, then moves on to the following week
+        reminded = Counter()
+        ticks = 0
+        started = time.perf_counter()
+        tick = now
+        while tick < now + interval:
+            tick += bot_module.REMINDER_TICK
+            reminded.update(scheduler.pop_due(tick))
+            ticks += 1
+        week_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        reloaded = bot_module.ReminderScheduler(path)
+        reload_seconds = time.perf_counter() - started
+
+    results = {
+        "users": args.users,
+        "schedule_calls": args.users * args.recalculations,
+        "growth": growth,
+        "week_ticks": ticks,
+        "week_tick_us": round(week_seconds / ticks * 1e6, 3),
+        "reminders_sent": sum(reminded.values()),
+        "reminders_reloaded": len(reloaded),
+        "reload_s": round(reload_seconds, 4),
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Throughput and error handling of the outgoing message queue (MessageSender) against a fake Bot API.
+
+Queues `--messages` messages spread over `--chats` chats and reports the sustained send rate
+against `--global-rate`, the busiest one-second window and the latency in the queue. Checks
+that every message is delivered once and in order within its chat, and that no chat goes over
+its own rate. A second run makes some chats reject every message ("chat not found") and answers
+one send with RetryAfter. Rejected messages must be tried once and not retried, and the
+RetryAfter must pause every chat, not just the one that got it.
+
+Usage:
+    python benchmarks/sender.py --messages 2000 --chats 300 --global-rate 200 --output sender.json
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from telegram.error import BadRequest, RetryAfter
+
+from load_test import FakeBot, load_bot
+
+
+class FlakyBot(FakeBot):
+    """FakeBot that rejects messages to `dead_chats` and answers its `flood_at`-th send with RetryAfter."""
+
+    def __init__(self, dead_chats=(), flood_at=None, retry_after=2):
+        super().__init__()
+        self.dead_chats = set(dead_chats)
+        self.flood_at = flood_at
+        self.retry_after = retry_after
+        self.flooded_at = None
+        self.rejected = 0
+        self._attempts = 0
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self._lock:
+            attempt = self._attempts
+            self._attempts += 1
+            if chat_id in self.dead_chats:
+                self.rejected += 1
+                raise BadRequest("Chat not found")
+            if attempt == self.flood_at:
+                self.flooded_at = time.perf_counter()
+                raise RetryAfter(self.retry_after)
+        super().send_message(chat_id, text, **kwargs)
+
+
+def send_all(bot_module, bot, messages, chats, args):
+    sender = bot_module.MessageSender(bot, global_rate=args.global_rate, chat_rate=args.chat_rate,
+                                      chat_burst=args.chat_burst, clock=time.perf_counter)
+    sender.start()
+    started = time.perf_counter()
+    for i in range(messages):
+        sender.send(i % chats, str(i))
+    sender.join()
+    elapsed = time.perf_counter() - started
+    sender.stop()
+    return sender, started, elapsed
+
+
+def check_delivery(calls, messages, chats, dead_chats, args):
+    """Every message to a live chat sent once, in order, and within the chat's token bucket."""
+    by_chat = defaultdict(list)
+    for at, chat_id, text in calls:
+        by_chat[chat_id].append((at, int(text)))
+    expected = [i for i in range(messages) if i % chats not in dead_chats]
+    assert sorted(int(text) for _, _, text in calls) == expected, "lost or duplicated messages"
+    for chat_id, sends in by_chat.items():
+        assert [i for _, i in sends] == sorted(i for _, i in sends), f"chat {chat_id} out of order"
+        tokens, last = args.chat_burst, sends[0][0]
+        for at, _ in sends:
+            tokens = min(args.chat_burst, tokens + (at - last) * args.chat_rate) - 1
+            last = at
+            assert tokens > -0.05, f"chat {chat_id} over its rate"
+
+
+def busiest_window(times, seconds=1.0):
+    times = sorted(times)
+    best, first = 0, 0
+    for last, at in enumerate(times):
+        while at - times[first] >= seconds:
+            first += 1
+        best = max(best, last - first + 1)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=300)
+    parser.add_argument("--global-rate", type=float, default=200, help="messages/sec (Telegram allows ~30)")
+    parser.add_argument("--chat-rate", type=float, default=1)
+    parser.add_argument("--chat-burst", type=float, default=3)
+    parser.add_argument("--dead-chats", type=int, default=10, help="chats rejecting every message in the error run")
+    parser.add_argument("--retry-after", type=float, default=2, help="seconds of the injected RetryAfter")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)  # The error run logs a warning per rejected message
+    bot_module = load_bot()
+    bot = FakeBot()
+    sender, started, elapsed = send_all(bot_module, bot, args.messages, args.chats, args)
+    check_delivery(bot.calls, args.messages, args.chats, set(), args)
+    times = [at for at, _, _ in bot.calls]
+    # The first second drains the global bucket's initial burst; the rest shows the sustained rate
+    steady = [at for at in times if at >= started + 1]
+    results = {
+        "messages": args.messages,
+        "chats": args.chats,
+        "global_rate": args.global_rate,
+        "elapsed_s": round(elapsed, 3),
+        "sustained_per_sec": round((len(steady) - 1) / (steady[-1] - steady[0]), 1) if len(steady) > 1 else None,
+        "busiest_second": busiest_window(times),
+        "busiest_second_after_burst": busiest_window(steady),
+        "sender": sender.stats(),
+    }
+
+    dead_chats = set(range(args.dead_chats))
+    bot = FlakyBot(dead_chats, flood_at=args.messages // 2, retry_after=args.retry_after)
+    sender, started, elapsed = send_all(bot_module, bot, args.messages, args.chats, args)
+    check_delivery(bot.calls, args.messages, args.chats, dead_chats, args)
+    dead_messages = sum(1 for i in range(args.messages) if i % args.chats in dead_chats)
+    assert bot.rejected == dead_messages, (bot.rejected, dead_messages)
+    paused = min(at for at, _, _ in bot.calls if at > bot.flooded_at) - bot.flooded_at
+    assert paused >= args.retry_after * 0.99, paused
+    results["errors"] = {
+        "elapsed_s": round(elapsed, 3),
+        "rejected_attempts": bot.rejected,
+        "rejected_messages": dead_messages,
+        "pause_after_retry_after_s": round(paused, 3),
+        "sender": sender.stats(),
+    }
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
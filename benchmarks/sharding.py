@@ -0,0 +1,83 @@
+"""Throughput of the sharded deployment (ShardRouter) as worker processes are added.
+
+Routes the load test's synthetic conversations through `ShardRouter` with 1..N worker
+processes against the fake Bot API and reports updates/sec and the per-shard split.
+
+Usage:
+    python benchmarks/sharding.py --users 5000 --shards 1 2 4 8 --bot-latency 1 --output sharding.json
+"""
+import argparse
+import datetime
+import functools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from load_test import FakeBot, build_updates, load_bot
+
+
+def run(bot_module, shards, users, bot_latency, seed, directory):
+    bot = FakeBot()
+    updates, _ = build_updates(bot, users, 1, seed)
+    payloads = [(update.effective_chat.id, update.to_json()) for update in updates]
+    base = os.path.join(directory, f"{shards}-shards")
+    router = bot_module.ShardRouter(functools.partial(FakeBot, bot_latency), shards=shards,
+                                    profile_db_path=base + "-profiles.db", reminder_db_path=base + "-reminders.db",
+                                    weight_db_path=base + "-weights.db", tip_db_path=base + "-tips.db",
+                                    state_journal_path=base + "-conversations",
+                                    admission_rate=None, chat_rate=1e9, chat_burst=1e9, global_rate=1e9)
+    router.start()
+    started = time.perf_counter()
+    for chat_id, payload in payloads:
+        router.submit_json(chat_id, payload, block=True)
+    while sum(router.processed) < len(payloads):
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    router.stop()
+    return {
+        "shards": shards,
+        "users": users,
+        "updates": len(payloads),
+        "elapsed_s": round(elapsed, 4),
+        "updates_per_sec": round(len(payloads) / elapsed, 1),
+        "processed_per_shard": list(router.processed),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000, help="synthetic users per run")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4], help="worker process counts to compare")
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="simulated Bot API round-trip in ms")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    bot_module = load_bot()
+    bot_module.METRICS_PORT = None  # Workers would otherwise each open a metrics port
+    results = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "bot_latency_ms": args.bot_latency,
+        "runs": [],
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for shards in args.shards:
+            results["runs"].append(run(bot_module, shards, args.users, args.bot_latency / 1000, args.seed, directory))
+    baseline = results["runs"][0]["updates_per_sec"]
+    for r in results["runs"]:
+        r["speedup"] = round(r["updates_per_sec"] / baseline, 2)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
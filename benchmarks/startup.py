@@ -0,0 +1,145 @@
+"""Cold-start cost of calorie-compass.py: module import time and time to the first handled update.
+
+Each run starts a fresh interpreter. The `python -X importtime` run reports what importing the
+module pulls in. The first-update run creates the app with `create_app()` against the fake
+Bot API, handles one /start update and waits for the reply to be sent, then answers the rest of
+the onboarding to time the first plan and to see which heavy modules serving it imported.
+
+Usage:
+    python benchmarks/startup.py --runs 5 --output startup.json
+"""
+import argparse
+import datetime
+import importlib.util
+import json
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+BOT_PATH = Path(__file__).resolve().parent.parent / "calorie-compass.py"
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+ONBOARDING = ["English", "30", "Male", "180", "80", "Moderately Active", "0.5"]  # After /start
+HEAVY_MODULES = ("numpy",)  # Imported only by the batch plan functions
+
+
+class ReplyBot:
+    """Minimal stand-in for telegram.Bot; the load test's FakeBot would import telegram before the timing starts."""
+
+    def __init__(self):
+        self.id = 1
+        self.username = "calorie_compass_bot"
+        self.first_name = "Calorie Compass"
+        self.defaults = None
+        self.replied = threading.Semaphore(0)
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.replied.release()
+
+
+def child():
+    """Runs in the fresh interpreter: import, build the app, handle one update; prints the phase timings."""
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location("calorie_compass", BOT_PATH)
+    bot_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot_module)
+    imported = time.perf_counter()
+
+    bot = ReplyBot()
+    dispatcher = bot_module.create_app(bot, workers=1, profile_db_path=None, reminder_db_path=None,
+                                       weight_db_path=None, tip_db_path=None, metrics_sample_rate=None,
+                                       chat_rate=1e9, chat_burst=1e9)  # Time the handlers, not the send rate
+    bot_module.message_sender.start()
+    created = time.perf_counter()
+
+    from telegram import Chat, Message, MessageEntity, Update, User
+
+    def handle(update_id, text):
+        entities = [MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text))] if text.startswith("/") else []
+        message = Message(update_id, datetime.datetime.now(), Chat(1, Chat.PRIVATE), from_user=User(1, "user", False),
+                          text=text, entities=entities, bot=bot)
+        dispatcher.process_update(Update(update_id, message=message))
+
+    handle(1, "/start")
+    bot.replied.acquire()
+    handled = time.perf_counter()
+    for update_id, text in enumerate(ONBOARDING, 2):
+        handle(update_id, text)
+    bot_module.message_sender.join()
+    planned = time.perf_counter()
+    bot_module.message_sender.stop()
+    print(json.dumps({
+        "import_s": imported - started,
+        "create_app_s": created - imported,
+        "first_update_s": handled - created,
+        "in_process_total_s": handled - started,
+        "first_plan_s": planned - handled,
+        "serving_imported": sorted(name for name in HEAVY_MODULES if name in sys.modules),
+    }))
+
+
+def run_child():
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, __file__, "--child"], check=True, capture_output=True, text=True).stdout
+    phases = json.loads(output)
+    phases["process_start_to_first_update_s"] = time.perf_counter() - started - phases["first_plan_s"]
+    return phases
+
+
+def import_profile(top):
+    """`python -X importtime` of just the module: total and the heaviest top-level imports."""
+    code = ("import importlib.util; spec = importlib.util.spec_from_file_location('calorie_compass', %r); "
+            "spec.loader.exec_module(importlib.util.module_from_spec(spec))" % str(BOT_PATH))
+    baseline = subprocess.run([sys.executable, "-X", "importtime", "-c", "import importlib.util"],
+                              check=True, capture_output=True, text=True).stderr
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            check=True, capture_output=True, text=True).stderr
+    seen = {match.group(4) for match in IMPORT_LINE.finditer(baseline)}
+    modules = []
+    for match in IMPORT_LINE.finditer(stderr):
+        self_us, cumulative_us, indent, name = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+        if name not in seen:
+            modules.append((name, len(indent), self_us, cumulative_us))
+    heaviest = sorted((m for m in modules if m[1] == 1), key=lambda m: -m[3])[:top]
+    return {
+        "modules_imported": len(modules),
+        "import_us_total": sum(m[2] for m in modules),
+        "heaviest_top_level": {name: cumulative_us for name, _, _, cumulative_us in heaviest},
+        "telegram_imported": any(m[0] == "telegram" for m in modules),
+        "numpy_imported": any(m[0] == "numpy" for m in modules),
+        "http_server_imported": any(m[0] == "http.server" for m in modules),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=10, help="heaviest imports to list")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        return child()
+
+    runs = [run_child() for _ in range(args.runs)]
+    results = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "runs": args.runs,
+        "median": {key: round(statistics.median(run[key] for run in runs), 4) for key in runs[0]
+                   if key != "serving_imported"},
+        "serving_imported": runs[0]["serving_imported"],
+        "importtime": import_profile(args.top),
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
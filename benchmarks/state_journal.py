@@ -0,0 +1,117 @@
+"""Write amplification and restart time of the conversation state journal (ConversationJournal).
+
+Drives `--conversations` conversations through `--steps` state changes each, as the dispatcher
+would, with the profile store connected: each step's answer goes into the user's profile first,
+so every record carries the profile values collected so far, until DONE drops them. Then
+reloads the state and restores the journaled profiles into an empty store, the way a bot
+restarted after a crash does. tests/test_state_journal.py checks the recovery itself.
+
+Usage:
+    python benchmarks/state_journal.py --conversations 1000000 --steps 3 --output journal.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from load_test import load_bot
+
+# Each step of the conversation and the answer the user has given on reaching it
+STEPS = [
+    ("LANGUAGE", {"language": "en", "invalid_attempts": 0}),
+    ("AGE", {"language": "en"}),
+    ("GENDER", {"age": 30}),
+    ("HEIGHT", {"gender": "male"}),
+    ("WEIGHT", {"height": 180.0}),
+    ("ACTIVITY_LEVEL", {"weight": 80.0}),
+    ("WEIGHT_LOSS_GOAL", {"activity_level": "moderately active"}),
+    ("DONE", {"weight_loss_goal": 0.5}),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=1_000_000)
+    parser.add_argument("--steps", type=int, default=3, help="state changes per conversation (max 8)")
+    parser.add_argument("--compact-every", type=int, default=None, help="journal records between snapshots")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    bot_module = load_bot()
+    steps = [(getattr(bot_module, name), answer) for name, answer in STEPS[:args.steps]]
+    snapshot_bytes = []
+
+    class MeasuredJournal(bot_module.ConversationJournal):
+        appended_bytes = 0
+
+        def _append(self, record):
+            self.appended_bytes += len(json.dumps(record, ensure_ascii=False).encode()) + 1
+            super()._append(record)
+
+        def _write_snapshot(self, state):
+            super()._write_snapshot(state)
+            snapshot_bytes.append(os.path.getsize(self.snapshot_path))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "conversations")
+        options = {"compact_every": args.compact_every} if args.compact_every else {}
+        persistence = MeasuredJournal(path, **options)
+        store = bot_module.MemoryProfileStore(max_profiles=args.conversations)
+        persistence.use_profile_store(store)
+        write_seconds = 0.0
+        # Step by step across all users, the way concurrent onboarding interleaves
+        for state, answer in steps:
+            for chat_id in range(1, args.conversations + 1):
+                profile = store.get(chat_id) or bot_module.UserProfile()
+                for key, value in answer.items():
+                    profile[key] = value
+                profile.updated = time.time()
+                store.put(chat_id, profile)
+                started = time.perf_counter()
+                persistence.update_conversation("onboarding", (chat_id, chat_id), state)
+                write_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        persistence.flush()
+        write_seconds += time.perf_counter() - started
+        journal_bytes = sum(os.path.getsize(p) for p in (persistence.journal_path, persistence.old_journal_path)
+                            if os.path.exists(p))
+        updates = args.conversations * len(steps)
+        appended_bytes = persistence.appended_bytes  # Every record is appended exactly once
+        # A persistence that rewrites every conversation on each change writes ~the full state every time
+        full_state_bytes = os.path.getsize(persistence.snapshot_path) if snapshot_bytes else appended_bytes
+
+        started = time.perf_counter()
+        restarted = bot_module.ConversationJournal(path, **options)
+        conversations = restarted.get_conversations("onboarding")
+        restored = bot_module.MemoryProfileStore(max_profiles=args.conversations)
+        restarted.use_profile_store(restored)  # Nothing was written to the profile database before the crash
+        restart_seconds = time.perf_counter() - started
+        assert len(conversations) == args.conversations
+
+        results = {
+            "conversations": args.conversations,
+            "state_updates": updates,
+            "write_seconds": round(write_seconds, 3),
+            "updates_per_sec": round(updates / write_seconds, 1),
+            "journal_bytes_appended": appended_bytes,
+            "bytes_per_record": round(appended_bytes / updates, 1),
+            "snapshots_written": len(snapshot_bytes),
+            "snapshot_bytes_written": sum(snapshot_bytes),
+            "journal_bytes_at_restart": journal_bytes,
+            "write_amplification": round((appended_bytes + sum(snapshot_bytes)) / appended_bytes, 3),
+            "full_rewrite_amplification_estimate": round(updates * full_state_bytes / 2 / appended_bytes, 1),
+            "restart_seconds": round(restart_seconds, 3),
+            "profiles_restored": len(restored),
+        }
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
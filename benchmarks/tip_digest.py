@@ -0,0 +1,96 @@
+"""Fan-out of the daily tip digest (TipRotation + MessageSender bulk lane) to many subscribed chats.
+
+Subscribes `--users` chats, runs one digest through the shared sender against the fake Bot API
+and reports digest throughput, rotation memory per chat and, with `--interactive-rate`, how
+long replies to active users wait while the digest is going out. tests/test_tips.py checks the
+rotations and that chats which blocked the bot, no longer exist or sent /stop get no more tips.
+
+Usage:
+    python benchmarks/tip_digest.py --users 100000 --global-rate 1000 --output digest.json
+"""
+import argparse
+import itertools
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from load_test import FakeBot, Histogram, load_bot
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--global-rate", type=float, default=1000,
+                        help="sender messages/sec (Telegram allows ~30; higher keeps the run short)")
+    parser.add_argument("--interactive-rate", type=float, default=20, help="replies/sec sent during the digest")
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="simulated Bot API round-trip in ms")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    bot_module = load_bot()
+    bot = FakeBot(args.bot_latency / 1000)
+    bot_module.init_services(bot, profile_db_path=None, reminder_db_path=None, weight_db_path=None, tip_db_path=None,
+                             metrics_sample_rate=None, global_rate=args.global_rate, chat_rate=1, chat_burst=3)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for chat_id in range(1, args.users + 1):
+        bot_module.tip_rotation.subscribe(chat_id, "en" if chat_id % 3 else "ru")
+    rotation_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    sender = bot_module.message_sender
+    sender.start()
+    started = time.perf_counter()
+    bot_module.send_tip_digest(None)
+    job_seconds = time.perf_counter() - started
+
+    # Replies to active users while the digest drains; their latency is what the bulk lane protects
+    reply_latency = Histogram()
+    queued_at = {}
+    stop = threading.Event()
+
+    def interactive():
+        for chat_id in itertools.count(10_000_000):
+            if stop.wait(1 / args.interactive_rate):
+                return
+            queued_at[chat_id] = time.perf_counter()
+            sender.send(chat_id, "reply")
+
+    replies = threading.Thread(target=interactive, daemon=True)
+    if args.interactive_rate:
+        replies.start()
+    sender.join()
+    digest_seconds = time.perf_counter() - started
+    stop.set()
+    if args.interactive_rate:
+        replies.join()
+    sender.stop()
+
+    for at, chat_id, _ in bot.calls:
+        if chat_id in queued_at:
+            reply_latency.add(at - queued_at[chat_id])
+
+    tips = sum(1 for _, chat_id, _ in bot.calls if chat_id < 10_000_000)
+    results = {
+        "users": args.users,
+        "global_rate": args.global_rate,
+        "digest_job_ms": round(job_seconds * 1000, 3),
+        "tips_sent": tips,
+        "digest_seconds": round(digest_seconds, 3),
+        "tips_per_sec": round(tips / digest_seconds, 1),
+        "projected_digest_minutes_at_30_per_sec": round(args.users / 30 / 60, 1),
+        "rotation_bytes_per_user": round(rotation_bytes / args.users, 1),
+        "reply_latency_during_digest": reply_latency.summary(),
+        "sender": sender.stats(),
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""Webhook mode under load: recorded update JSON POSTed to a local WebhookServer over HTTP.
+
+Starts the WebhookServer with a known secret token, the real handlers and the fake Bot API,
+then `--clients` threads POST the updates the way Telegram does, each chat's updates from one
+client and in order, retrying after a 503. Reports the clients' updates/sec and POST latency,
+the responses by status, and the server's own /stats: updates/sec and queue wait.
+
+Updates are read from `--updates`, one JSON update per line; without it the load test's
+synthetic users are recorded, and `--record` writes them out for replaying later.
+
+Usage:
+    python benchmarks/webhook.py --users 2000 --clients 8 --record updates.jsonl --output webhook.json
+    python benchmarks/webhook.py --updates updates.jsonl
+"""
+import argparse
+import datetime
+import http.client
+import json
+import platform
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from queue import Queue
+
+from telegram.ext import Dispatcher
+
+from load_test import FakeBot, Histogram, build_updates, load_bot
+
+SECRET_TOKEN = "webhook-benchmark"
+
+
+def chat_id(payload):
+    update = json.loads(payload)
+    message = update.get("message") or update.get("edited_message") or {}
+    return message.get("chat", {}).get("id", 0)
+
+
+class Client:
+    """POSTs payloads over one connection per request, as BaseHTTPRequestHandler closes each one."""
+
+    def __init__(self, port, path):
+        self.port = port
+        self.path = path
+        self.statuses = Counter()
+        self.latency = Histogram()
+
+    def post(self, payload, token=SECRET_TOKEN) -> int:
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        try:
+            started = time.perf_counter()
+            connection.request("POST", self.path, body=payload, headers={
+                "Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": token})
+            response = connection.getresponse()
+            response.read()
+            self.latency.add(time.perf_counter() - started)
+        finally:
+            connection.close()
+        self.statuses[response.status] += 1
+        return response.status
+
+    def replay(self, payloads):
+        for payload in payloads:
+            while self.post(payload) == 503:  # Telegram redelivers after a while
+                time.sleep(0.01)
+
+    def get(self, path) -> dict:
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        try:
+            connection.request("GET", path)
+            return json.loads(connection.getresponse().read())
+        finally:
+            connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", help="file of recorded updates, one JSON update per line")
+    parser.add_argument("--users", type=int, default=2000, help="synthetic users when no --updates are given")
+    parser.add_argument("--record", help="write the synthetic updates to this file")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent connections POSTing updates")
+    parser.add_argument("--workers", type=int, default=8, help="UpdateWorkerPool workers")
+    parser.add_argument("--queue-size", type=int, default=1000, help="UpdateWorkerPool queue size")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    bot_module = load_bot()
+    bot = FakeBot()
+    expected_plans = None
+    if args.updates:
+        payloads = [line for line in Path(args.updates).read_text().splitlines() if line.strip()]
+    else:
+        updates, expected_plans = build_updates(bot, args.users, 1, args.seed)
+        payloads = [update.to_json() for update in updates]
+        if args.record:
+            Path(args.record).write_text("".join(payload + "\n" for payload in payloads))
+
+    bot_module.init_services(bot, profile_db_path=None, reminder_db_path=None, weight_db_path=None, tip_db_path=None,
+                             metrics_sample_rate=None, admission_rate=None,
+                             global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+    dispatcher = Dispatcher(bot, Queue(), workers=1)
+    bot_module.register_handlers(dispatcher)
+    server = bot_module.WebhookServer(dispatcher, listen="127.0.0.1", port=0, workers=args.workers,
+                                      queue_size=args.queue_size, secret_token=SECRET_TOKEN)
+    port = server.server_address[1]
+    bot_module.message_sender.start()
+    threading.Thread(target=server.serve_forever, name="webhook", daemon=True).start()
+
+    # Each chat's updates from one client, in order, as Telegram delivers them
+    clients = [Client(port, server.path) for _ in range(args.clients)]
+    shares = [[] for _ in clients]
+    for payload in payloads:
+        shares[hash(chat_id(payload)) % len(clients)].append(payload)
+    threads = [threading.Thread(target=client.replay, args=(share,)) for client, share in zip(clients, shares)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    posted = time.perf_counter() - started
+    while clients[0].get(server.path + "/stats")["processed"] < len(payloads):
+        time.sleep(0.01)
+    handled = time.perf_counter() - started
+    stats = clients[0].get(server.path + "/stats")
+    server.shutdown()
+    server.server_close()
+    bot_module.message_sender.stop()
+
+    statuses = sum((client.statuses for client in clients), Counter())
+    latency = Histogram()
+    for client in clients:
+        latency.samples.extend(client.latency.samples)
+    results = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "updates": len(payloads),
+        "clients": args.clients,
+        "workers": args.workers,
+        "queue_size": args.queue_size,
+        "posted_s": round(posted, 4),
+        "handled_s": round(handled, 4),
+        "updates_per_sec": round(len(payloads) / handled, 1),
+        "responses": {str(status): count for status, count in sorted(statuses.items())},
+        "post_latency": latency.summary(),
+        "completed_plans": len(bot_module.reminder_scheduler),
+        "expected_plans": expected_plans,
+        "server_stats": stats,
+        "sender": bot_module.message_sender.stats(),
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
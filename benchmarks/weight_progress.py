@@ -0,0 +1,138 @@
+"""Cost of weigh-in logging (WeightLog) with years of daily entries per user.
+
+Appends `--years` of daily weigh-ins for each of `--users` users and reports the time per
+weigh-in, the memory per user, the /progress summary latency and the time to reload a
+history from SQLite. The incremental aggregates are checked against, and timed next to, a
+recomputation from the full history on every weigh-in.
+
+Usage:
+    python benchmarks/weight_progress.py --users 1000 --years 5 --output weights.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from load_test import load_bot
+
+
+def recompute(days, weights, average_days, trend_days):
+    """Rolling average and trend slope from the whole history, as done without running aggregates."""
+    days = np.asarray(days, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    today = days[-1]
+    average = weights[days > today - average_days].mean()
+    recent = days > today - trend_days
+    slope = np.polyfit(days[recent], weights[recent], 1)[0] if recent.sum() >= 2 else None
+    return average, slope
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--years", type=float, default=5)
+    parser.add_argument("--skip-rate", type=float, default=0.2, help="fraction of days without a weigh-in")
+    parser.add_argument("--recompute-users", type=int, default=5, help="users also timed with full recomputation")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    bot_module = load_bot()
+    bot_module.load_localization()
+    rng = random.Random(args.seed)
+    days = int(args.years * 365)
+    histories = []
+    for _ in range(args.users):
+        weight = rng.uniform(60, 120)
+        history = []
+        for day in range(days):
+            weight += rng.gauss(-0.01, 0.3)
+            if rng.random() >= args.skip_rate:
+                history.append((day, round(weight, 1)))
+        histories.append(history)
+    entries = sum(len(history) for history in histories)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "weights.db")
+        log = bot_module.WeightLog(path, max_series=args.users)
+        started = time.perf_counter()
+        for user_id, history in enumerate(histories):
+            for day, weight in history:
+                log.add(user_id, weight, now=day * 86400)
+        append_seconds = time.perf_counter() - started
+
+        # The in-memory part alone, without the SQLite write
+        memory_log = bot_module.WeightLog(None)
+        started = time.perf_counter()
+        for user_id, history in enumerate(histories):
+            for day, weight in history:
+                memory_log.add(user_id, weight, now=day * 86400)
+        memory_append_seconds = time.perf_counter() - started
+
+        # Full recomputation on each weigh-in, for a few users; also checks the running aggregates
+        recompute_entries = 0
+        recompute_seconds = 0.0
+        max_error = 0.0
+        for history in histories[:args.recompute_users]:
+            series = bot_module.WeightSeries()
+            for day, weight in history:
+                series.add(day, weight)
+                started = time.perf_counter()
+                average, slope = recompute(series.days, series.weights,
+                                           bot_module.WEIGHT_AVERAGE_DAYS, bot_module.WEIGHT_TREND_DAYS)
+                recompute_seconds += time.perf_counter() - started
+                recompute_entries += 1
+                max_error = max(max_error, abs(average - series.average))
+                if slope is not None:
+                    max_error = max(max_error, abs(slope - series.trend))
+        assert max_error < 1e-6, max_error
+
+        series = memory_log.get(0)
+        language_options = bot_module.LOCALES["en"]
+        profile = bot_module.UserProfile(age=35, gender="male", height=180, weight=series.average,
+                                         activity_level="sedentary", weight_loss_goal=0.5)
+        started = time.perf_counter()
+        for _ in range(10_000):
+            series.tdee = None
+            bot_module.progress_summary(series, profile, language_options)
+        summary_seconds = (time.perf_counter() - started) / 10_000
+
+        log.close()
+        reloaded = bot_module.WeightLog(path, max_series=1)
+        started = time.perf_counter()
+        for user_id in range(min(args.users, 100)):
+            reloaded.get(user_id)
+        reload_seconds = (time.perf_counter() - started) / min(args.users, 100)
+        reloaded.close()
+        db_bytes = os.path.getsize(path)
+
+    bytes_per_user = sum(s.days.itemsize * len(s.days) + s.weights.itemsize * len(s.weights)
+                         for s in memory_log._series.values()) / args.users
+    results = {
+        "users": args.users,
+        "days_per_user": days,
+        "weigh_ins": entries,
+        "append_us_per_weigh_in": round(append_seconds / entries * 1e6, 2),
+        "append_in_memory_us_per_weigh_in": round(memory_append_seconds / entries * 1e6, 2),
+        "recompute_us_per_weigh_in": round(recompute_seconds / recompute_entries * 1e6, 2) if recompute_entries else None,
+        "max_aggregate_error": max_error,
+        "progress_summary_us": round(summary_seconds * 1e6, 2),
+        "history_bytes_per_user": math.ceil(bytes_per_user),
+        "reload_ms_per_user": round(reload_seconds * 1000, 3),
+        "db_bytes_per_weigh_in": round(db_bytes / entries, 1),
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
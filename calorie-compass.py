@@ -1,196 +1,1783 @@
+import bisect
 import datetime
+import functools
+import heapq
+import hmac
+import itertools
+import json
+import logging
+import math
+import os
 import random
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler, CallbackContext, JobQueue
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, defaultdict, deque
+from dataclasses import dataclass, fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Full, Queue
+from typing import TYPE_CHECKING, Optional
+
+# python-telegram-bot, numpy and multiprocessing are imported where they are first needed:
+# importing this module stays cheap for tools, and workers are up sooner after a scale-out
+if TYPE_CHECKING:
+    import numpy as np
+    from telegram import Update
+    from telegram.ext import CallbackContext
 
 # Constants
+TOKEN = 'TOKEN'
 LANGUAGE, AGE, GENDER, WEIGHT, HEIGHT, ACTIVITY_LEVEL, WEIGHT_LOSS_GOAL, DONE, RESTART = range(9)
-SCHEDULE_TIME = datetime.time(9, 0, 0)
-
-# Initialize the bot
-updater = Updater(token='TOKEN', use_context=True)
-dispatcher = updater.dispatcher
-job_queue = updater.job_queue
-
-# Store user data
-user_data_dict = {}
-scheduled_jobs = {}
-
-# Nutrition Tips
-NUTRITION_TIPS = {
-    "en": [
-        "Drink at least 8 glasses of water daily to stay hydrated!",
-        "Include a variety of fruits and vegetables in your diet to get essential vitamins and minerals.",
-        "Balance your meals with protein, carbohydrates, and healthy fats.",
-        "Regular physical activity helps maintain a healthy weight and boosts overall health.",
-        "Try to limit sugary drinks and snacks, opting for whole foods instead.",
-        "Eat more fiber-rich foods like whole grains, legumes, and vegetables to support digestion.",
-        "Incorporate healthy fats, such as those from avocados, nuts, and olive oil, into your diet.",
-        "Avoid skipping breakfast; it's important to fuel your body for the day ahead.",
-        "Practice portion control to avoid overeating and maintain a healthy weight.",
-        "Limit your intake of processed and fast foods, which are often high in unhealthy fats and sodium.",
-        "Consider eating smaller, more frequent meals throughout the day to keep your energy levels stable.",
-        "Choose lean protein sources, such as chicken, fish, and plant-based options, to support muscle growth and repair.",
-        "Be mindful of your salt intake; too much sodium can lead to high blood pressure.",
-        "Enjoy meals with others whenever possible, as this can encourage healthier eating habits.",
-        "Plan your meals ahead of time to make healthier choices and avoid last-minute unhealthy options."
-    ],
-    "ru": [
-        "Пейте не менее 8 стаканов воды в день, чтобы оставаться гидратированными!",
-        "Включайте в свой рацион разнообразные фрукты и овощи, чтобы получать необходимые витамины и минералы.",
-        "Сбалансируйте приемы пищи, включая белки, углеводы и полезные жиры.",
-        "Регулярная физическая активность помогает поддерживать здоровый вес и укрепляет общее здоровье.",
-        "Старайтесь ограничивать употребление сладких напитков и закусок, выбирая вместо этого цельные продукты.",
-        "Ешьте больше продуктов, богатых клетчаткой, таких как цельные зерна, бобовые и овощи, чтобы поддерживать работу пищеварения.",
-        "Включайте в рацион полезные жиры, такие как авокадо, орехи и оливковое масло.",
-        "Не пропускайте завтрак; важно запастись энергией на весь день.",
-        "Практикуйте контроль порций, чтобы избежать переедания и поддерживать здоровый вес.",
-        "Ограничивайте употребление обработанных и фастфуд-продуктов, которые часто содержат вредные жиры и много соли.",
-        "Рассмотрите возможность частых, но небольших приемов пищи в течение дня, чтобы поддерживать стабильный уровень энергии.",
-        "Выбирайте нежирные источники белка, такие как курица, рыба и растительные продукты, для поддержки роста и восстановления мышц.",
-        "Следите за потреблением соли; избыток натрия может привести к повышению артериального давления.",
-        "Старайтесь есть вместе с другими людьми, это может способствовать формированию здоровых пищевых привычек.",
-        "Планируйте приемы пищи заранее, чтобы делать более здоровый выбор и избегать незапланированных нездоровых вариантов."
-    ]
+END = -1  # ConversationHandler.END
+CONVERSATION_NAME = "onboarding"
+SCHEDULE_TIME = datetime.time(9, 0, 0)  # Daily nutrition tip digest, in UTC
+PROFILE_CACHE_SIZE = 100_000  # Max profiles kept in memory
+PROFILE_DB_PATH = "profiles.db"  # Set to None to keep profiles in memory only
+PROFILE_FLUSH_BATCH = 500  # Pending profile writes that trigger a commit
+PROFILE_FLUSH_INTERVAL = 5  # Seconds between background profile commits
+REMINDER_DB_PATH = "reminders.db"  # Set to None to keep reminder due times in memory only
+REMINDER_INTERVAL = 604800  # One week between progress reminders
+REMINDER_TICK = 60  # Seconds between checks for due reminders
+WEIGHT_DB_PATH = "weights.db"  # Set to None to keep weigh-ins in memory only
+WEIGHT_CACHE_SIZE = 10_000  # Users whose weigh-in history is kept in memory
+WEIGHT_AVERAGE_DAYS = 7  # Days in the rolling average weight
+WEIGHT_TREND_DAYS = 28  # Days in the weight trend line
+TIP_DB_PATH = "tips.db"  # Set to None to keep tip rotations in memory only
+TIP_FLUSH_BATCH = 1000  # Advanced tip rotations written per commit during a digest
+SEND_GLOBAL_RATE = 30  # Telegram allows about 30 messages per second per bot
+SEND_CHAT_RATE = 1  # ...and about one message per second per chat
+SEND_CHAT_BURST = 3  # Short bursts per chat, e.g. the plan followed by the recalculate prompt
+SEND_QUEUE_SIZE = 10_000  # Pending outgoing messages before senders are made to wait
+SEND_WORKERS = 4  # Threads making Bot API calls
+SEND_MAX_RETRIES = 5  # Attempts per message on network errors
+SEND_BULK_WINDOW = 30  # Bulk messages (tip digests, reminders) queued at a time, so replies wait behind at most this many
+ADMISSION_USER_RATE = 1  # Updates per second handled for one user; None turns admission control off
+ADMISSION_USER_BURST = 5  # ...with short bursts, e.g. a few quick answers in a row
+ADMISSION_GLOBAL_RATE = 100  # Updates per second handled in all; replies go out at SEND_GLOBAL_RATE anyway
+ADMISSION_MAX_DELAY = 3  # Seconds an update over its user's rate may be held back; later ones are dropped
+ADMISSION_HOLD_LIMIT = 3  # Updates held back per user
+ADMISSION_TICK = 0.2  # Seconds between releases of held-back updates
+RUNTIME_MODE = "sync"  # "sync": one dispatcher thread, "pool": polled updates go to the worker pool, concurrently across chats
+INGESTION_MODE = "polling"  # "polling" or "webhook"
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_URL = None  # Public base URL registered with Telegram, e.g. "https://example.com"
+# Telegram sends it with every update; requests without it are refused. Without WEBHOOK_URL the webhook is
+# registered elsewhere, or updates are POSTed locally, so it must be set; otherwise a random one is used
+WEBHOOK_SECRET_TOKEN = None
+WEBHOOK_WORKERS = 8  # Threads processing updates in webhook and pool mode
+WEBHOOK_QUEUE_SIZE = 1000  # Queued updates before Telegram is asked to retry later, or polling waits
+METRICS_LISTEN = "127.0.0.1"
+METRICS_PORT = 9100  # Prometheus text endpoint at /metrics; None disables metrics
+METRICS_SAMPLE_RATE = 1.0  # Fraction of calls that are timed; counters are always exact
+STATE_JOURNAL_PATH = "conversations"  # Prefix of the conversation state files; None keeps state in memory only
+STATE_COMPACT_EVERY = 100_000  # Journal records between snapshots
+STATE_FSYNC_INTERVAL = 1.0  # Seconds between journal fsyncs
+SHARD_COUNT = 1  # Worker processes; above 1, updates are routed to them by chat_id
+SHARD_QUEUE_SIZE = 1000  # Updates waiting per worker process
+LOCALE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales")  # Texts and tips, one JSON file per language
+
+logger = logging.getLogger(__name__)
+
+# Services, created by init_services() so the handlers can be imported without starting anything
+profile_store = None
+reminder_scheduler = None
+weight_log = None
+tip_rotation = None
+message_sender = None
+admission_control = None
+metrics = None
+
+# Keyboard layouts by canonical value; button labels come from each language's options
+GENDER_KEYBOARD_LAYOUT = [["male", "female"]]
+ACTIVITY_KEYBOARD_LAYOUT = [["sedentary", "lightly active"], ["moderately active", "very active", "super active"]]
+RESTART_KEYBOARD_LAYOUT = [["start over", "use previous"]]
+
+# Localization, prepared once at startup
+def normalize_input(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def keyboard_markup(rows) -> str:
+    # Serialized once, as telegram.ReplyKeyboardMarkup would; the Bot API accepts the JSON string as reply_markup as-is
+    return json.dumps({"selective": False, "one_time_keyboard": True, "resize_keyboard": True,
+                       "keyboard": [[{"text": label} for label in row] for row in rows]})
+
+class Locale:
+    """Texts, serialized keyboards and input lookups for one language."""
+
+    __slots__ = ("code", "texts", "keyboards", "genders", "activities", "restart_choices")
+
+    def __init__(self, code, texts):
+        self.code = code
+        self.texts = texts
+        self.keyboards = {
+            "gender": keyboard_markup([[texts["gender_options"][key] for key in row] for row in GENDER_KEYBOARD_LAYOUT]),
+            "activity": keyboard_markup([[texts["activity_options"][key] for key in row] for row in ACTIVITY_KEYBOARD_LAYOUT]),
+            "restart": keyboard_markup([[texts["restart_options"][key] for key in row] for row in RESTART_KEYBOARD_LAYOUT]),
+            "recalculate": keyboard_markup([[texts["recalculate_button"]]]),
+        }
+        # Normalized button text -> canonical value
+        self.genders = {normalize_input(label): key for key, label in texts["gender_options"].items()}
+        self.genders.update(texts["gender_aliases"])
+        self.activities = {normalize_input(label): key for key, label in texts["activity_options"].items()}
+        self.activities.update(texts["activity_aliases"])
+        self.restart_choices = {normalize_input(label): key for key, label in texts["restart_options"].items()}
+
+    def __getitem__(self, key):
+        return self.texts[key]
+
+
+# Filled in by load_localization()
+LANGUAGES = None  # Language codes, in the order of their "language_position" on the language keyboard
+LOCALES = None
+LANGUAGES_BY_NAME = None
+LANGUAGE_KEYBOARD = None
+RESTART_CHOICES = None
+NUTRITION_TIPS = None
+REMOVE_KEYBOARD = json.dumps({"remove_keyboard": True, "selective": False})
+
+def load_localization(directory=LOCALE_DIR):
+    """Read the texts and nutrition tips of every language in `directory`, one `<code>.json` each, once."""
+    global LANGUAGES, LOCALES, LANGUAGES_BY_NAME, LANGUAGE_KEYBOARD, RESTART_CHOICES, NUTRITION_TIPS
+    if LOCALES is not None:
+        return
+    language_options = {}
+    for name in os.listdir(directory):
+        code, extension = os.path.splitext(name)
+        if extension == ".json":
+            with open(os.path.join(directory, name), encoding="utf-8") as data:
+                language_options[code] = json.load(data)
+    language_options = dict(sorted(language_options.items(), key=lambda item: item[1]["language_position"]))
+    LANGUAGES = tuple(language_options)
+    NUTRITION_TIPS = {code: texts.pop("nutrition_tips") for code, texts in language_options.items()}
+    LOCALES = {code: Locale(code, texts) for code, texts in language_options.items()}
+    LANGUAGES_BY_NAME = {normalize_input(texts["language_name"]): code for code, texts in language_options.items()}
+    LANGUAGE_KEYBOARD = keyboard_markup([[texts["language_name"] for texts in language_options.values()]])
+    RESTART_CHOICES = {label: key for locale in LOCALES.values() for label, key in locale.restart_choices.items()}
+
+# Profile storage
+@dataclass(slots=True)
+class UserProfile:
+    language: str = "en"
+    invalid_attempts: int = 0
+    age: Optional[int] = None
+    gender: Optional[str] = None
+    height: Optional[float] = None
+    weight: Optional[float] = None
+    activity_level: Optional[str] = None
+    weight_loss_goal: Optional[float] = None
+    updated: Optional[float] = None  # When a handler last queued it for writing; orders it against journaled values
+
+    # Dict-style access so the handlers can keep using user_data['key']
+    def __getitem__(self, key):
+        value = getattr(self, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return getattr(self, key, None) is not None
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in PROFILE_FIELDS if getattr(self, name) is not None]
+
+
+PROFILE_FIELDS = tuple(field.name for field in fields(UserProfile))
+
+
+class MemoryProfileStore:
+    """Keeps at most `max_profiles` profiles, evicting the least recently used one."""
+
+    def __init__(self, max_profiles=PROFILE_CACHE_SIZE):
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id) -> Optional[UserProfile]:
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is not None:
+                self._profiles.move_to_end(user_id)
+            return profile
+
+    def put(self, user_id, profile: UserProfile):
+        with self._lock:
+            self._profiles[user_id] = profile
+            self._profiles.move_to_end(user_id)
+            if len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteProfileStore:
+    """LRU cache in front of SQLite; changed profiles are written back in batched commits."""
+
+    def __init__(self, path, max_profiles=PROFILE_CACHE_SIZE, batch_size=PROFILE_FLUSH_BATCH):
+        self.batch_size = batch_size
+        self._cache = MemoryProfileStore(max_profiles)
+        self._dirty = {}
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(PROFILE_FIELDS)
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS profiles (user_id INTEGER PRIMARY KEY, {columns})")
+        existing = {row[1] for row in self._db.execute("PRAGMA table_info(profiles)")}
+        for name in PROFILE_FIELDS:
+            if name not in existing:  # A table from before the field was added
+                self._db.execute(f"ALTER TABLE profiles ADD COLUMN {name}")
+        self._select = f"SELECT {columns} FROM profiles WHERE user_id = ?"
+        self._upsert = f"INSERT OR REPLACE INTO profiles (user_id, {columns}) " \
+                       f"VALUES (?, {', '.join('?' * len(PROFILE_FIELDS))})"
+
+    def get(self, user_id) -> Optional[UserProfile]:
+        profile = self._cache.get(user_id)
+        if profile is not None:
+            return profile
+        with self._lock:
+            # A profile evicted from the cache may still be waiting to be written
+            profile = self._dirty.get(user_id)
+            if profile is None:
+                row = self._db.execute(self._select, (user_id,)).fetchone()
+                if row is None:
+                    return None
+                profile = UserProfile(*row)
+        self._cache.put(user_id, profile)
+        return profile
+
+    def put(self, user_id, profile: UserProfile):
+        """Cache the profile and queue it for the next batched write."""
+        with self._lock:
+            # Flush before queueing so the caller's pending changes go out with the next batch
+            if len(self._dirty) >= self.batch_size:
+                self.flush()
+            self._dirty[user_id] = profile
+        self._cache.put(user_id, profile)
+
+    def __len__(self):
+        self.flush()  # Queued profiles may or may not be in the table yet
+        return self._db.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+
+    def items(self):
+        """Every stored profile as (user_id, profile)."""
+        self.flush()
+        for user_id, *values in self._db.execute(f"SELECT user_id, {', '.join(PROFILE_FIELDS)} FROM profiles"):
+            yield user_id, UserProfile(*values)
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            rows = [(user_id, *(getattr(profile, name) for name in PROFILE_FIELDS))
+                    for user_id, profile in self._dirty.items()]
+            self._dirty.clear()
+            with self._db:
+                self._db.executemany(self._upsert, rows)
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+
+
+# Reminder scheduling
+class ReminderScheduler:
+    """One due time per chat, kept in a heap and driven by a single repeating job."""
+
+    def __init__(self, path=REMINDER_DB_PATH, interval=REMINDER_INTERVAL):
+        self.interval = interval
+        self._due = {}
+        self._heap = []
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS reminders (chat_id INTEGER PRIMARY KEY, due REAL)")
+            self._due = dict(self._db.execute("SELECT chat_id, due FROM reminders"))
+            self._heap = [(due, chat_id) for chat_id, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def schedule(self, chat_id, first=None, now=None):
+        """Set the chat's next reminder, replacing any reminder it already had."""
+        due = (time.time() if now is None else now) + (self.interval if first is None else first)
+        with self._lock:
+            self._due[chat_id] = due
+            heapq.heappush(self._heap, (due, chat_id))
+            self._compact()
+            self._save([(chat_id, due)])
+
+    def cancel(self, chat_id):
+        with self._lock:
+            if self._due.pop(chat_id, None) is not None and self._db:
+                with self._db:
+                    self._db.execute("DELETE FROM reminders WHERE chat_id = ?", (chat_id,))
+
+    def pop_due(self, now=None) -> list:
+        """Return the chats whose reminder is due and move each of them to its next week."""
+        now = time.time() if now is None else now
+        due_chats, rescheduled = [], []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, chat_id = heapq.heappop(self._heap)
+                if self._due.get(chat_id) != due:
+                    continue  # Replaced or cancelled since it was pushed
+                due_chats.append(chat_id)
+                next_due = due + self.interval
+                if next_due <= now:  # Missed several weeks while the bot was down
+                    next_due = now + self.interval
+                self._due[chat_id] = next_due
+                rescheduled.append((next_due, chat_id))
+            for entry in rescheduled:
+                heapq.heappush(self._heap, entry)
+            self._save([(chat_id, due) for due, chat_id in rescheduled])
+        return due_chats
+
+    def __len__(self):
+        return len(self._due)
+
+    def due_times(self) -> dict:
+        with self._lock:
+            return dict(self._due)
+
+    def _compact(self):
+        # Replaced reminders leave stale heap entries behind; rebuild once they dominate
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [(due, chat_id) for chat_id, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def _save(self, rows):
+        if self._db and rows:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO reminders (chat_id, due) VALUES (?, ?)", rows)
+
+
+
+# Weight progress
+class WeightWindow:
+    """Least-squares sums over the weigh-ins of the last `days` days, updated as entries enter and leave."""
+
+    __slots__ = ("days", "start", "n", "sx", "sy", "sxx", "sxy")
+
+    def __init__(self, days):
+        self.days = days
+        self.start = 0  # Index of the oldest entry still in the window
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.sxy = 0.0
+
+    def add(self, x, y, sign=1):
+        self.n += sign
+        self.sx += sign * x
+        self.sy += sign * y
+        self.sxx += sign * x * x
+        self.sxy += sign * x * y
+
+    def advance(self, series, today):
+        """Drop the entries that are now older than the window; each entry leaves once."""
+        days, weights, origin = series.days, series.weights, series.days[0]
+        while days[self.start] <= today - self.days:
+            self.add(days[self.start] - origin, weights[self.start], -1)
+            self.start += 1
+
+    @property
+    def mean(self) -> float:
+        return self.sy / self.n
+
+    @property
+    def slope(self) -> Optional[float]:
+        denominator = self.n * self.sxx - self.sx * self.sx
+        if self.n < 2 or denominator <= 0:
+            return None
+        return (self.n * self.sxy - self.sx * self.sy) / denominator
+
+
+class WeightSeries:
+    """One user's weigh-ins: day numbers and weights in compact arrays, one entry per day."""
+
+    __slots__ = ("days", "weights", "average_window", "trend_window", "tdee", "daily_calories")
+
+    def __init__(self, average_days=WEIGHT_AVERAGE_DAYS, trend_days=WEIGHT_TREND_DAYS):
+        self.days = array("I")  # Days since the epoch
+        self.weights = array("f")
+        self.average_window = WeightWindow(average_days)
+        self.trend_window = WeightWindow(trend_days)
+        # Plan for the current average weight, filled in by the handlers
+        self.tdee = self.daily_calories = None
+
+    def add(self, day, weight):
+        """Append a weigh-in in O(1); a second weigh-in on the same day replaces the first."""
+        if self.days and day < self.days[-1]:
+            raise ValueError(f"weigh-in for day {day} is older than the latest one")
+        windows = (self.average_window, self.trend_window)
+        if self.days and day == self.days[-1]:
+            x = day - self.days[0]
+            for window in windows:
+                window.add(x, self.weights[-1], -1)
+            self.weights[-1] = weight
+        else:
+            self.days.append(day)
+            self.weights.append(weight)
+        x = day - self.days[0]
+        for window in windows:
+            window.add(x, self.weights[-1])  # The stored float32, so removing it later cancels exactly
+            window.advance(self, day)
+        self.tdee = self.daily_calories = None
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def first(self) -> float:
+        return self.weights[0]
+
+    @property
+    def latest(self) -> float:
+        return self.weights[-1]
+
+    @property
+    def average(self) -> float:
+        return self.average_window.mean
+
+    @property
+    def trend(self) -> Optional[float]:
+        """Slope of the trend line in kg per day, or None with fewer than two days to fit."""
+        return self.trend_window.slope
+
+
+class WeightLog:
+    """Weigh-ins per user; histories of recently active users stay in memory, the rest are reloaded from SQLite."""
+
+    def __init__(self, path=WEIGHT_DB_PATH, max_series=WEIGHT_CACHE_SIZE):
+        self.max_series = max_series
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS weigh_ins "
+                             "(user_id INTEGER, day INTEGER, weight REAL, PRIMARY KEY (user_id, day)) WITHOUT ROWID")
+
+    def get(self, user_id) -> Optional[WeightSeries]:
+        with self._lock:
+            return self._load(user_id)
+
+    def add(self, user_id, weight, now=None) -> WeightSeries:
+        day = int((time.time() if now is None else now) // 86400)
+        with self._lock:
+            series = self._load(user_id)
+            if series is None:
+                series = self._series[user_id] = WeightSeries()
+                self._evict()
+            series.add(day, weight)
+            if self._db:
+                with self._db:
+                    self._db.execute("INSERT OR REPLACE INTO weigh_ins (user_id, day, weight) VALUES (?, ?, ?)",
+                                     (user_id, day, weight))
+        return series
+
+    def entries(self):
+        """Every weigh-in as (user_id, day, weight)."""
+        if self._db:
+            yield from self._db.execute("SELECT user_id, day, weight FROM weigh_ins ORDER BY user_id, day")
+        else:
+            for user_id, series in list(self._series.items()):
+                for day, weight in zip(series.days, series.weights):
+                    yield user_id, day, weight
+
+    def close(self):
+        if self._db:
+            self._db.close()
+
+    def _load(self, user_id) -> Optional[WeightSeries]:
+        series = self._series.get(user_id)
+        if series is not None:
+            self._series.move_to_end(user_id)
+            return series
+        if not self._db:
+            return None
+        rows = self._db.execute("SELECT day, weight FROM weigh_ins WHERE user_id = ? ORDER BY day", (user_id,))
+        for day, weight in rows:
+            if series is None:
+                series = WeightSeries()
+            series.add(day, weight)
+        if series is not None:
+            self._series[user_id] = series
+            self._evict()
+        return series
+
+    def _evict(self):
+        # Without a database the histories only live here, so nothing is evicted
+        if self._db and len(self._series) > self.max_series:
+            self._series.popitem(last=False)
+
+
+
+# Nutrition tips
+def _mix64(x) -> int:
+    # splitmix64 finalizer: a cheap, stable hash of (seed, cycle)
+    x = (x + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return x ^ (x >> 31)
+
+_coprimes = {}
+
+def rotation_index(seed, sent, shift, count) -> int:
+    """Tip shown as a chat's `sent`-th tip: cycle `sent // count` visits every tip once, in the order
+    k -> (a * k + b + shift) % count, with a coprime to count and a, b derived from the seed and cycle."""
+    coprimes = _coprimes.get(count)
+    if coprimes is None:
+        coprimes = _coprimes[count] = [a for a in range(1, count + 1) if math.gcd(a, count) == 1]
+    cycle, k = divmod(sent, count)
+    h = _mix64(seed << 32 | cycle)
+    return (coprimes[h % len(coprimes)] * k + (h >> 32) + shift) % count
+
+
+class TipRotation:
+    """Subscribed chats and where each one is in its own shuffled order of the tips.
+
+    A chat's state is four numbers, (seed, sent, shift, language), never a list of tips: the
+    order is recomputed from the seed. `shift` is chosen at the start of each cycle so that the
+    first tip of a cycle is never the last tip of the previous one.
+    """
+
+    def __init__(self, path=TIP_DB_PATH, flush_batch=TIP_FLUSH_BATCH):
+        self.flush_batch = flush_batch
+        self._state = {}  # chat_id -> (seed, sent, shift, language)
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS tip_rotation "
+                             "(chat_id INTEGER PRIMARY KEY, seed INTEGER, sent INTEGER, shift INTEGER, language TEXT)")
+            self._state = {chat_id: tuple(state) for chat_id, *state in
+                           self._db.execute("SELECT chat_id, seed, sent, shift, language FROM tip_rotation")}
+
+    def subscribe(self, chat_id, language, seed=None):
+        """Add the chat to the daily digest; a chat already subscribed keeps its place and switches language."""
+        with self._lock:
+            state = self._state.get(chat_id)
+            if state is None:
+                state = (random.getrandbits(32) if seed is None else seed, 0, 0, language)
+            else:
+                state = state[:3] + (language,)
+            self._set(chat_id, state)
+            self._flush()
+
+    def unsubscribe(self, chat_id):
+        with self._lock:
+            if self._state.pop(chat_id, None) is not None and self._db:
+                self._dirty[chat_id] = None
+                self._flush()
+
+    def advance(self, chat_id, tip_counts) -> Optional[tuple]:
+        """Return (language, tip index) of the chat's next tip, or None if it is not subscribed.
+
+        `tip_counts` maps each language to its number of tips.
+        """
+        with self._lock:
+            state = self._state.get(chat_id)
+            if state is None:
+                return None
+            seed, sent, shift, language = state
+            count = tip_counts[language]
+            if sent and sent % count == 0:
+                last = rotation_index(seed, sent - 1, shift, count)
+                shift = 1 if rotation_index(seed, sent, 0, count) == last else 0
+            index = rotation_index(seed, sent, shift, count)
+            self._set(chat_id, (seed, sent + 1, shift, language))
+            if len(self._dirty) >= self.flush_batch:
+                self._flush()
+            return language, index
+
+    def chats(self) -> list:
+        with self._lock:
+            return list(self._state)
+
+    def entries(self):
+        """Every subscribed chat as (chat_id, seed, sent, shift, language)."""
+        with self._lock:
+            return [(chat_id, *state) for chat_id, state in self._state.items()]
+
+    def restore(self, chat_id, seed, sent, shift, language):
+        with self._lock:
+            self._set(chat_id, (seed, sent, shift, language))
+
+    def __len__(self):
+        return len(self._state)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+        if self._db:
+            self._db.close()
+
+    def _set(self, chat_id, state):
+        self._state[chat_id] = state
+        if self._db:
+            self._dirty[chat_id] = state
+
+    def _flush(self):
+        if not self._dirty:
+            return
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO tip_rotation (chat_id, seed, sent, shift, language) "
+                                 "VALUES (?, ?, ?, ?, ?)",
+                                 [(chat_id, *state) for chat_id, state in self._dirty.items() if state is not None])
+            self._db.executemany("DELETE FROM tip_rotation WHERE chat_id = ?",
+                                 [(chat_id,) for chat_id, state in self._dirty.items() if state is None])
+        self._dirty.clear()
+
+
+
+# Outgoing messages
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now) -> float:
+        """Take a token and return 0, or return the seconds until one is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    def pause(self, seconds, now):
+        """Hand out no tokens for the next `seconds`."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate, 1 - seconds * self.rate)
+        self.updated = now
+
+
+class MessageSender:
+    """Bounded outgoing queue that sends within Telegram's global and per-chat rate limits.
+
+    Messages for one chat are sent one at a time and in order. A full queue blocks the caller.
+    Bulk messages, such as the daily tip digest, are drawn from their iterable only while fewer
+    than `bulk_window` of them are queued, so replies never wait behind a whole digest.
+    `on_unreachable` is called with the chat_id of a chat that blocked the bot or no longer exists.
+    """
+
+    def __init__(self, bot, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST,
+                 max_size=SEND_QUEUE_SIZE, workers=SEND_WORKERS, max_retries=SEND_MAX_RETRIES,
+                 bulk_window=SEND_BULK_WINDOW, on_unreachable=None, clock=time.monotonic):
+        self.bot = bot
+        self.on_unreachable = on_unreachable
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_size = max_size
+        self.workers = workers
+        self.max_retries = max_retries
+        self.bulk_window = bulk_window
+        self.clock = clock
+        self._global_bucket = TokenBucket(global_rate, global_rate, clock())
+        self._chat_buckets = {}
+        self._pending = {}  # chat_id -> deque of [kwargs, enqueued_at, attempts, bulk]
+        self._ready = []  # (not_before, seq, chat_id) for chats with pending messages
+        self._seq = itertools.count()
+        self._size = 0
+        self._bulk = deque()  # Iterables of (chat_id, text) still to be drawn from
+        self._bulk_queued = 0
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.bulk_sent = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def send(self, chat_id, text, **kwargs):
+        with self._cond:
+            while self._size >= self.max_size:
+                self._cond.wait()
+            self._enqueue(chat_id, dict(kwargs, chat_id=chat_id, text=text), bulk=False)
+            self._cond.notify()
+
+    def pending(self, chat_id) -> bool:
+        """Whether a message to the chat is still queued or being sent."""
+        return chat_id in self._pending
+
+    def send_bulk(self, messages):
+        """Send every (chat_id, text) of `messages`, drawn lazily as the rate limits leave room; returns at once."""
+        with self._cond:
+            self._bulk.append(iter(messages))
+            self._cond.notify()
+
+    def start(self):
+        self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Send what is still queued, then stop the workers."""
+        self.join(timeout)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def join(self, timeout=None) -> bool:
+        """Wait until every queued message, bulk ones included, has been sent or given up on."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._size == 0 and self._in_flight == 0 and not self._bulk, timeout)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._size,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "bulk_sent": self.bulk_sent,
+            "bulk_pending": len(self._bulk),
+            "latency_avg": self.latency_total / self.sent if self.sent else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+    def _enqueue(self, chat_id, message, bulk):
+        # Called with the lock held
+        now = self.clock()
+        queue = self._pending.get(chat_id)
+        if queue is None:
+            queue = self._pending[chat_id] = deque()
+            heapq.heappush(self._ready, (now, next(self._seq), chat_id))
+        queue.append([message, now, 0, bulk])
+        self._size += 1
+
+    def _draw_bulk(self):
+        # Called with the lock held: top the bulk messages in the queue back up to the window
+        while self._bulk and self._bulk_queued < self.bulk_window:
+            try:
+                chat_id, text = next(self._bulk[0])
+            except StopIteration:
+                self._bulk.popleft()
+                continue
+            except Exception:
+                logger.exception("Bulk message source failed")
+                self._bulk.popleft()
+                continue
+            self._enqueue(chat_id, {"chat_id": chat_id, "text": text}, bulk=True)
+            self._bulk_queued += 1
+
+    def _next_message(self):
+        """Block until a chat may send, then take its oldest message."""
+        with self._cond:
+            while self._running:
+                self._draw_bulk()
+                now = self.clock()
+                if not self._ready or self._ready[0][0] > now:
+                    self._cond.wait(self._ready[0][0] - now if self._ready else None)
+                    continue
+                not_before, seq, chat_id = heapq.heappop(self._ready)
+                bucket = self._chat_buckets.get(chat_id)
+                if bucket is None:
+                    bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+                wait = bucket.take(now)
+                if not wait:
+                    wait = self._global_bucket.take(now)
+                    if wait:
+                        bucket.tokens += 1  # Give back the chat token, the chat did not send
+                if wait:
+                    heapq.heappush(self._ready, (now + wait, seq, chat_id))
+                    continue
+                self._in_flight += 1
+                return chat_id, self._pending[chat_id][0]
+            return None
+
+    def _finish(self, chat_id, retry_at=None, sent_at=None):
+        """Retry the chat's oldest message at `retry_at`, or drop it from the queue."""
+        with self._cond:
+            self._in_flight -= 1
+            queue = self._pending[chat_id]
+            if retry_at is not None:
+                self.retried += 1
+            else:
+                _, enqueued_at, _, bulk = queue.popleft()
+                self._size -= 1
+                if bulk:
+                    self._bulk_queued -= 1
+                    self.bulk_sent += sent_at is not None
+                if sent_at is None:
+                    self.failed += 1
+                else:
+                    self.sent += 1
+                    self.latency_total += sent_at - enqueued_at
+                    self.latency_max = max(self.latency_max, sent_at - enqueued_at)
+            if queue:
+                heapq.heappush(self._ready, (retry_at or self.clock(), next(self._seq), chat_id))
+            else:
+                del self._pending[chat_id]
+                if len(self._chat_buckets) > self.max_size:
+                    now = self.clock()
+                    self._chat_buckets = {chat: bucket for chat, bucket in self._chat_buckets.items()
+                                          if not bucket.is_full(now)}
+            self._cond.notify_all()
+
+    def _pause(self, seconds):
+        with self._cond:
+            self._global_bucket.pause(seconds, self.clock())
+
+    def _work(self):
+        from telegram.error import BadRequest, NetworkError, RetryAfter, Unauthorized
+
+        while True:
+            item = self._next_message()
+            if item is None:
+                return
+            chat_id, message = item
+            try:
+                self.bot.send_message(**message[0])
+            except RetryAfter as e:
+                # Telegram's flood limit applies to the whole bot, not just this chat
+                self._pause(e.retry_after)
+                self._finish(chat_id, retry_at=self.clock() + e.retry_after)
+            except (BadRequest, Unauthorized) as e:
+                # Permanent, e.g. "chat not found" or a blocked bot: retrying would only hold up the chat's queue
+                logger.warning("Message to chat %s rejected: %s", chat_id, e)
+                self._finish(chat_id)
+                if self.on_unreachable and (isinstance(e, Unauthorized) or "chat not found" in e.message.lower()):
+                    try:
+                        self.on_unreachable(chat_id)
+                    except Exception:
+                        logger.exception("Failed to forget unreachable chat %s", chat_id)
+            except NetworkError as e:
+                message[2] += 1
+                if message[2] < self.max_retries:
+                    self._finish(chat_id, retry_at=self.clock() + 0.5 * 2 ** message[2])
+                else:
+                    logger.warning("Giving up on message to chat %s after %d attempts: %s", chat_id, message[2], e)
+                    self._finish(chat_id)
+            except Exception:
+                logger.exception("Failed to send message to chat %s", chat_id)
+                self._finish(chat_id)
+            else:
+                self._finish(chat_id, sent_at=self.clock())
+
+
+# Admission control
+class AdmissionState:
+    """What admission control remembers about one user."""
+
+    __slots__ = ("bucket", "text", "held")
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.text = None  # Text of the user's last admitted or held message
+        self.held = 0  # Updates held back until the bucket refills
+
+
+class AdmissionControl:
+    """Decides, before any handler runs, whether an update is handled now, held back or dropped.
+
+    Each user may have `user_rate` updates per second handled, in bursts of up to `user_burst`,
+    and the whole bot `global_rate`. An update over its user's rate is held back if a token is
+    due within `max_delay` and fewer than `hold_limit` of the user's updates are already held.
+    Otherwise it is dropped, as are updates over the global rate. A message that repeats the
+    user's previous text while a reply to the chat is still pending is dropped as a duplicate.
+    Held updates that are due are handed to `release`, the way new updates come in; None is the
+    dispatcher's own update queue.
+    """
+
+    SHED_REASONS = ("duplicate", "user_rate", "global_rate")
+
+    def __init__(self, user_rate=ADMISSION_USER_RATE, user_burst=ADMISSION_USER_BURST, global_rate=ADMISSION_GLOBAL_RATE,
+                 max_delay=ADMISSION_MAX_DELAY, hold_limit=ADMISSION_HOLD_LIMIT, reply_pending=None, clock=time.monotonic):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_delay = max_delay
+        self.hold_limit = hold_limit
+        self.reply_pending = reply_pending or (lambda chat_id: False)
+        self.clock = clock
+        self.release = None  # Set by release_updates_to()
+        self._global_bucket = TokenBucket(global_rate, global_rate, clock())
+        self._users = {}  # user_id -> AdmissionState
+        self._prune_at = 1024
+        self._held = []  # (due, seq, user_id, update)
+        self._released = set()  # update_ids of held updates being processed again
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.delayed = 0
+        self.shed = dict.fromkeys(self.SHED_REASONS, 0)
+
+    def admit(self, update) -> str:
+        """Return "admitted", "held", or why the update is dropped: one of SHED_REASONS."""
+        with self._lock:
+            if update.update_id in self._released:
+                self._released.discard(update.update_id)
+                return "admitted"
+            now = self.clock()
+            chat = update.effective_chat
+            user = update.effective_user or chat
+            message = update.effective_message
+            text = message.text if message else None
+            state = None
+            wait = 0.0
+            if user is not None:
+                state = self._users.get(user.id)
+                if state is None:
+                    if len(self._users) >= self._prune_at:
+                        self._prune(now)
+                    state = self._users[user.id] = AdmissionState(TokenBucket(self.user_rate, self.user_burst, now))
+                if text is not None and text == state.text and (state.held or chat and self.reply_pending(chat.id)):
+                    return self._shed("duplicate")
+                wait = state.bucket.take(now)
+                if wait and (wait > self.max_delay or state.held >= self.hold_limit):
+                    return self._shed("user_rate")
+            if self._global_bucket.take(now):
+                if state is not None and not wait:
+                    state.bucket.tokens += 1  # Give back the user's token, the update is not handled
+                return self._shed("global_rate")
+            if state is not None:
+                state.text = text
+            if not wait:
+                self.admitted += 1
+                return "admitted"
+            state.bucket.tokens -= 1  # Reserved for the held update, so the user's next one waits behind it
+            state.held += 1
+            self.delayed += 1
+            heapq.heappush(self._held, (now + wait, next(self._seq), user.id, update))
+            return "held"
+
+    def pop_due(self, now=None) -> list:
+        """Remove and return the held updates whose turn has come, oldest first; they are admitted when processed again."""
+        with self._lock:
+            now = self.clock() if now is None else now
+            due = []
+            while self._held and self._held[0][0] <= now:
+                _, _, user_id, update = heapq.heappop(self._held)
+                self._users[user_id].held -= 1
+                self._released.add(update.update_id)
+                due.append(update)
+            return due
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "delayed": self.delayed,
+            "held": len(self._held),
+            "shed": dict(self.shed),
+            "users": len(self._users),
+        }
+
+    def _shed(self, reason) -> str:
+        # Called with the lock held
+        self.shed[reason] += 1
+        return reason
+
+    def _prune(self, now):
+        # Called with the lock held: forget users who are back to a full bucket with nothing held
+        self._users = {user_id: state for user_id, state in self._users.items()
+                       if state.held or not state.bucket.is_full(now)}
+        self._prune_at = max(1024, 2 * len(self._users))
+
+
+# Worker pool and webhook ingestion
+class UpdateWorkerPool:
+    """Fixed set of workers, each with its own bounded queue; a chat always goes to the same worker."""
+
+    def __init__(self, dispatcher, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.dispatcher = dispatcher
+        self._queues = [Queue(max(1, queue_size // workers)) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self.started = None
+        self.received = 0
+        self.processed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def start(self):
+        self.started = time.monotonic()
+        for i, queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._work, args=(queue,), name=f"update-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Process what is already queued, then stop the workers."""
+        for queue in self._queues:
+            queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, update, block=False) -> bool:
+        """Queue the update, or return False if its worker is full and `block` is false."""
+        chat = update.effective_chat
+        queue = self._queues[hash(chat.id if chat else None) % len(self._queues)]
+        with self._lock:
+            self.received += 1
+        try:
+            queue.put((update, time.monotonic()), block=block)
+        except Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        return True
+
+    def put(self, update):
+        """Queue.put() for the Updater: polling waits while the worker is full."""
+        from telegram import Update
+
+        if isinstance(update, Update):
+            self.submit(update, block=True)
+        else:
+            logger.error("Error while getting updates: %s", update)
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        return {
+            "queue_depth": sum(queue.qsize() for queue in self._queues),
+            "received": self.received,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "updates_per_sec": self.processed / elapsed if elapsed else 0.0,
+            "queue_wait_avg": self.wait_total / self.processed if self.processed else 0.0,
+            "queue_wait_max": self.wait_max,
+        }
+
+    def _work(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            update, enqueued_at = item
+            wait = time.monotonic() - enqueued_at
+            try:
+                self.dispatcher.process_update(update)
+            except Exception:
+                logger.exception("Error while processing update %s", update)
+            with self._lock:
+                self.processed += 1
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    server: "WebhookServer"
+
+    def do_POST(self):
+        from telegram import Update
+
+        if self.path != self.server.path:
+            return self._respond(404)
+        secret_token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(secret_token.encode(), self.server.secret_token.encode()):
+            return self._respond(403)
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            update = Update.de_json(json.loads(body), self.server.bot)
+        except Exception:  # Not JSON, or JSON that is not an update, e.g. {"message": 1}
+            update = None
+        if update is None:
+            return self._respond(400)
+        if not self.server.pool.submit(update):
+            # Telegram redelivers updates that were not acknowledged with a 2xx
+            return self._respond(503, headers={"Retry-After": "1"})
+        self._respond(200)
+
+    def do_GET(self):
+        if self.path != self.server.path + "/stats":
+            return self._respond(404)
+        self._respond(200, json.dumps(self.server.pool.stats()).encode())
+
+    def _respond(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per update is too noisy under load
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """Accepts Telegram update JSON over HTTP and hands it to an UpdateWorkerPool.
+
+    POST updates to `path` with `secret_token` in the X-Telegram-Bot-Api-Secret-Token header; GET
+    `path + "/stats"` for throughput and queue wait numbers.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128  # Telegram opens up to 40 connections at once; the default backlog is 5
+
+    def __init__(self, dispatcher, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                 workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE, pool=None, secret_token=WEBHOOK_SECRET_TOKEN):
+        super().__init__((listen, port), WebhookRequestHandler)
+        self.bot = dispatcher.bot
+        self.path = path
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self.pool = pool or UpdateWorkerPool(dispatcher, workers, queue_size)
+
+    def serve_forever(self, poll_interval=0.5):
+        self.pool.start()
+        super().serve_forever(poll_interval)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.stop()
+
+
+# Conversation state persistence
+class ConversationJournal:
+    """Conversation states kept in an append-only journal with background snapshots.
+
+    Each change is appended to `<path>.journal` as one JSON line. A user's profile lives in the
+    profile store, which writes behind, so while the user answers the prompts a state change is
+    recorded together with the profile values collected so far: after a crash the conversation
+    resumes with the answers it expects, not just the step. On loading, those values replace the
+    stored profile only if they are newer. Once the journal holds at least
+    `compact_every` records, and at least as many records as there are live entries, it is rotated
+    to `<path>.journal.old` and the current state is written to `<path>.snapshot` on a background
+    thread, after which the old journal is deleted. Loading reads the snapshot and
+    replays whatever journal files are left; records only ever set a value, so replaying a journal
+    that the snapshot already covers is harmless.
+    """
+
+    def __init__(self, path=STATE_JOURNAL_PATH, compact_every=STATE_COMPACT_EVERY, fsync_interval=STATE_FSYNC_INTERVAL):
+        self.compact_every = compact_every
+        self.fsync_interval = fsync_interval
+        self.snapshot_path = path + ".snapshot"
+        self.journal_path = path + ".journal"
+        self.old_journal_path = self.journal_path + ".old"
+        self._lock = threading.Lock()
+        self._conversations = defaultdict(dict)  # name -> {key: state}
+        self._profiles = {}  # user_id -> profile values, while the user is in a conversation
+        self.profile_store = None  # Set by use_profile_store()
+        self._records = 0  # Records appended since the last snapshot
+        self._last_fsync = time.monotonic()
+        self._compaction = None
+        self._load()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _load(self):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8") as snapshot:
+                data = json.load(snapshot)
+            for name, conversations in data["conversations"].items():
+                self._conversations[name] = {tuple(key): state for key, state in conversations}
+            self._profiles = {int(user_id): values for user_id, values in data.get("profiles", {}).items()}
+        for path in (self.old_journal_path, self.journal_path):
+            if os.path.exists(path):
+                self._records += self._replay(path)
+
+    def _replay(self, path) -> int:
+        count = 0
+        with open(path, encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # A write cut short by a crash; nothing after it was acknowledged
+                self._apply(record)
+                count += 1
+        return count
+
+    def _apply(self, record):
+        if record[0] != "c":
+            return  # Chat data, which older versions kept
+        _, name, key, state, *profile = record
+        if state is None:
+            self._conversations[name].pop(tuple(key), None)
+        else:
+            self._conversations[name][tuple(key)] = state
+        if profile:
+            self._profiles[key[-1]] = profile[0]
+        else:
+            self._profiles.pop(key[-1], None)
+
+    def _append(self, record):
+        with self._lock:
+            self._apply(record)
+            self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._journal.flush()
+            now = time.monotonic()
+            if now - self._last_fsync >= self.fsync_interval:
+                os.fsync(self._journal.fileno())
+                self._last_fsync = now
+            self._records += 1
+            if self._records >= self.compact_every and self._compaction is None:
+                # Let the journal grow as large as the state so snapshots cost O(1) amortized per record
+                live = sum(map(len, self._conversations.values())) + len(self._profiles)
+                if self._records >= live:
+                    self._start_compaction()
+
+    def _start_compaction(self):
+        # Called with the lock held: rotate the journal and copy the state, then write the snapshot unlocked
+        self._journal.close()
+        os.replace(self.journal_path, self.old_journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._records = 0
+        state = {
+            "conversations": {name: [[list(key), value] for key, value in conversations.items()]
+                              for name, conversations in self._conversations.items()},
+            "profiles": dict(self._profiles),
+        }
+        self._compaction = threading.Thread(target=self._write_snapshot, args=(state,), name="state-snapshot", daemon=True)
+        self._compaction.start()
+
+    def _write_snapshot(self, state):
+        try:
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as snapshot:
+                json.dump(state, snapshot, ensure_ascii=False)
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            os.remove(self.old_journal_path)
+        except OSError:
+            logger.exception("Failed to write the conversation snapshot")
+        finally:
+            self._compaction = None
+
+    def get_conversations(self, name):
+        with self._lock:
+            return dict(self._conversations[name])
+
+    def use_profile_store(self, store):
+        """Put journaled profile values that are newer than the stored profile back into `store`, then journal
+        each state change's profile from it.
+        """
+        with self._lock:
+            for user_id, values in self._profiles.items():
+                profile = store.get(user_id)
+                if profile is not None and (profile.updated or 0) >= values.get("updated", 0):
+                    continue  # Written since, e.g. by /plan, which changes no conversation state
+                profile = UserProfile()
+                for key, value in values.items():
+                    profile[key] = value
+                store.put(user_id, profile)
+            self.profile_store = store
+
+    def update_conversation(self, name, key, new_state):
+        # Profile values are journaled only while the user answers the prompts, so the journal keeps no
+        # profile of users who finished; the conversation key ends with the user id (per_user, the default)
+        onboarding = self.profile_store and new_state is not None and new_state != DONE
+        profile = self.profile_store.get(key[-1]) if onboarding else None
+        values = dict(profile.items()) if profile is not None else None
+        if self._conversations[name].get(key) == new_state and self._profiles.get(key[-1]) == values:
+            return  # Handlers often keep the state, e.g. when a message only logs a weigh-in
+        self.restore(name, key, new_state, values)
+
+    def entries(self, name):
+        """Every conversation as (key, state, profile values or None)."""
+        with self._lock:
+            return [(key, state, self._profiles.get(key[-1])) for key, state in self._conversations[name].items()]
+
+    def restore(self, name, key, state, values=None):
+        self._append(["c", name, list(key), state] + ([values] if values is not None else []))
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def update_chat_data(self, chat_id, data):
+        pass  # No handler uses chat data
+
+    def get_user_data(self):
+        return defaultdict(dict)
+
+    def update_user_data(self, user_id, data):
+        pass  # Profiles live in the profile store
+
+    def get_bot_data(self):
+        return {}
+
+    def update_bot_data(self, data):
+        pass
+
+    def flush(self):
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+        with self._lock:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+
+JournalPersistence = None  # ConversationJournal as a telegram.ext.BasePersistence, defined by journal_persistence()
+
+def journal_persistence(path=STATE_JOURNAL_PATH, **options):
+    """A ConversationJournal the dispatcher accepts as its persistence."""
+    global JournalPersistence
+    if JournalPersistence is None:
+        from telegram.ext import BasePersistence
+
+        class JournalPersistence(ConversationJournal, BasePersistence):
+            def __init__(self, path=STATE_JOURNAL_PATH, **options):
+                BasePersistence.__init__(self, store_user_data=False, store_chat_data=False, store_bot_data=False)
+                ConversationJournal.__init__(self, path, **options)
+
+    return JournalPersistence(path, **options)
+
+
+# Instrumentation
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STATE_NAMES = {
+    LANGUAGE: "language", AGE: "age", GENDER: "gender", WEIGHT: "weight", HEIGHT: "height",
+    ACTIVITY_LEVEL: "activity_level", WEIGHT_LOSS_GOAL: "weight_loss_goal", DONE: "done", RESTART: "restart",
+    END: "end",
 }
 
-# Language dictionaries
-LANGUAGE_OPTIONS = {
-    "en": {
-        "start": "Hello! I'm your diet planner bot. Let's get started.",
-        "choose_language": "Please choose your language:",
-        "age_prompt": "Step 1 of 6: Please provide your age (e.g., 25):",
-        "gender_prompt": "Step 2 of 6: Please specify your gender (Male or Female):",
-        "height_prompt": "Step 3 of 6: Please enter your height in cm (e.g., 170):",
-        "weight_prompt": "Step 4 of 6: Please enter your weight in kg (e.g., 70):",
-        "activity_prompt": "Step 5 of 6: Please select your activity level:",
-        "weight_loss_goal_prompt": "Step 6 of 6: Please enter your weight loss goal in kg per week (e.g., 0.5):",
-        "age_error": "Please enter a valid age (e.g., 25).",
-        "height_error": "Please enter a valid height (e.g., 170 cm).",
-        "weight_error": "Please enter a valid weight (e.g., 70 kg).",
-        "activity_error": "Invalid activity level. Please choose one from the options provided.",
-        "weight_loss_goal_error": "Please enter a valid weight loss goal (e.g., 0.5 kg per week).",
-        "weight_loss_goal_warning": "Losing more than 1 kg per week is generally not recommended as it can be unhealthy. "
-                                    "Remember, 'Patience is a virtue'. Please consider setting a more gradual goal.",
-        "diet_plan_ready": "Your diet plan is ready!\n"
-                           "Recommended daily calorie intake: {} calories.\n"
-                           "Suggested daily calorie intake for weight loss: {} calories.\n"
-                           "Remember: 'Slow and steady wins the race.'",
-        "gender_error": "Invalid input. Please select your gender using the buttons.",
-        "cancel": "You have canceled the conversation.",
-        "recalculate_prompt": "If you would like to recalculate, please press the 'Recalculate' button.",
-        "recalculate_button": "Recalculate",
-        "restart_prompt": "You've entered incorrect values multiple times. Would you like to start over or use your previous valid inputs?",
-        "restart_options": [["Start Over", "Use Previous"]],
-        "invalid_input": "Invalid input. Please follow the instructions.",
-        "language_options": [["English", "Русский"]],
-        "nutrition_tip": "Here's a nutrition tip for you: ",
-        "progress_reminder": "It's time to update your progress! How are you doing with your weight loss goal?",
-    },
-    "ru": {
-        "start": "Здравствуйте! Я ваш бот-диетолог. Давайте начнем.",
-        "choose_language": "Пожалуйста, выберите ваш язык:",
-        "age_prompt": "Шаг 1 из 6: Пожалуйста, укажите ваш возраст (например, 25):",
-        "gender_prompt": "Шаг 2 из 6: Пожалуйста, укажите ваш пол (Мужской или Женский):",
-        "height_prompt": "Шаг 3 из 6: Пожалуйста, введите ваш рост в см (например, 170):",
-        "weight_prompt": "Шаг 4 из 6: Пожалуйста, введите ваш вес в кг (например, 70):",
-        "activity_prompt": "Шаг 5 из 6: Пожалуйста, выберите ваш уровень активности:",
-        "weight_loss_goal_prompt": "Шаг 6 из 6: Пожалуйста, введите вашу цель по снижению веса в кг в неделю (например, 0.5):",
-        "age_error": "Пожалуйста, введите корректный возраст (например, 25).",
-        "height_error": "Пожалуйста, введите корректный рост (например, 170 см).",
-        "weight_error": "Пожалуйста, введите корректный вес (например, 70 кг).",
-        "activity_error": "Неверный уровень активности. Пожалуйста, выберите один из предложенных вариантов.",
-        "weight_loss_goal_error": "Пожалуйста, введите корректное значение для вашей цели по снижению веса (например, 0.5 кг в неделю).",
-        "weight_loss_goal_warning": "Похудение более чем на 1 кг в неделю обычно не рекомендуется, "
-                                    "так как это может быть нездорово. "
-                                    "Помните, 'Терпение — добродетель'. Пожалуйста, рассмотрите возможность установки более постепенной цели.",
-        "diet_plan_ready": "Ваш план диеты готов!\n"
-                           "Рекомендуемое ежедневное потребление калорий: {} калорий.\n"
-                           "Предлагаемое ежедневное потребление калорий для снижения веса: {} калорий.\n"
-                           "Помните: 'Тише едешь — дальше будешь.'",
-        "gender_error": "Неверный ввод. Пожалуйста, выберите ваш пол, используя кнопки.",
-        "cancel": "Вы отменили разговор.",
-        "recalculate_prompt": "Если вы хотите пересчитать, нажмите кнопку 'Пересчитать'.",
-        "recalculate_button": "Пересчитать",
-        "restart_prompt": "Вы несколько раз ввели неверные данные. Хотите начать сначала или использовать предыдущие допустимые значения?",
-        "restart_options": [["Начать сначала", "Использовать предыдущие"]],
-        "invalid_input": "Неверный ввод. Пожалуйста, следуйте инструкциям.",
-        "language_options": [["English", "Русский"]],
-        "nutrition_tip": "Вот совет по питанию: ",
-        "progress_reminder": "Пора обновить ваши данные! Как у вас дела с достижением цели по снижению веса?",
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Counters and latency histograms rendered in the Prometheus text format.
+
+    With a sample rate below 1 only every n-th call is timed, which keeps the clock reads off
+    most updates; counts stay exact.
+    """
+
+    PREFIX = "calorie_compass_"
+    HELP = {
+        "handler_calls_total": "Handler callbacks run, by handler.",
+        "handler_errors_total": "Handler callbacks that raised, by handler.",
+        "handler_latency_seconds": "Handler callback run time, by handler (sampled).",
+        "invalid_inputs_total": "Inputs rejected by a step, which then asks again, by state.",
+        "restart_escalations_total": "Repeated invalid input that sent the user to the restart prompt, by state.",
+        "state_entries_total": "Users moved into a conversation state, by state.",
+        "bot_api_calls_total": "Bot API calls, by method.",
+        "bot_api_errors_total": "Bot API calls that raised, by method.",
+        "bot_api_latency_seconds": "Bot API call round-trip, by method (sampled).",
+        "updates_held_total": "Updates over their user's rate held back to be handled later.",
+        "updates_shed_total": "Updates dropped before any handler ran, by reason.",
     }
-}
+
+    def __init__(self, sample_rate=METRICS_SAMPLE_RATE):
+        self.sample_every = max(1, round(1 / sample_rate)) if sample_rate > 0 else 0
+        self._ticks = 0
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._gauges = {}  # name -> (help, function returning {labels: value})
+
+    def sample(self) -> bool:
+        """Whether the current call should be timed."""
+        if not self.sample_every:
+            return False
+        self._ticks += 1
+        return self._ticks % self.sample_every == 0
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self._inc(name, labels, value)
+
+    def observe(self, name, labels, seconds):
+        with self._lock:
+            self._observe(name, labels, seconds)
+
+    def _inc(self, name, labels, value=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name, labels, seconds):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def add_gauge(self, name, help_text, collect):
+        """Register a gauge read at scrape time; `collect` returns {labels: value}."""
+        self._gauges[name] = (help_text, collect)
+
+    def record_handler(self, name, state, next_state, latency=None):
+        handler = (("handler", name),)
+        with self._lock:
+            self._inc("handler_calls_total", handler)
+            if latency is not None:
+                self._observe("handler_latency_seconds", handler, latency)
+            if next_state is None:
+                return
+            if next_state == state:
+                self._inc("invalid_inputs_total", (("state", STATE_NAMES[state]),))
+            else:
+                if next_state == RESTART and state is not None:
+                    self._inc("restart_escalations_total", (("state", STATE_NAMES[state]),))
+                self._inc("state_entries_total", (("state", STATE_NAMES.get(next_state, str(next_state))),))
+
+    def record_bot_call(self, method, latency=None, failed=False):
+        labels = (("method", method),)
+        with self._lock:
+            self._inc("bot_api_calls_total", labels)
+            if failed:
+                self._inc("bot_api_errors_total", labels)
+            if latency is not None:
+                self._observe("bot_api_latency_seconds", labels, latency)
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count)) for key, h in self._histograms.items())
+        lines = []
+        seen = set()
+
+        def header(name, kind, help_text):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {self.PREFIX}{name} {help_text}")
+                lines.append(f"# TYPE {self.PREFIX}{name} {kind}")
+
+        def labels_text(labels, extra=()):
+            pairs = [f'{key}="{value}"' for key, value in labels + extra]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        for (name, labels), value in counters:
+            header(name, "counter", self.HELP.get(name, name))
+            lines.append(f"{self.PREFIX}{name}{labels_text(labels)} {value}")
+        for (name, labels), (counts, total, count) in histograms:
+            header(name, "histogram", self.HELP.get(name, name))
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f"{self.PREFIX}{name}_bucket{labels_text(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{self.PREFIX}{name}_sum{labels_text(labels)} {total}")
+            lines.append(f"{self.PREFIX}{name}_count{labels_text(labels)} {count}")
+        for name, (help_text, collect) in sorted(self._gauges.items()):
+            header(name, "gauge", help_text)
+            for labels, value in sorted(collect().items()):
+                lines.append(f"{self.PREFIX}{name}{labels_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedBot:
+    """Wraps a Bot so every API method call is counted and (sampled) timed."""
+
+    def __init__(self, bot, metrics):
+        self._bot = bot
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._bot, name)
+        if not callable(attr):
+            return attr
+        metrics = self._metrics
+
+        def call(*args, **kwargs):
+            start = time.perf_counter() if metrics.sample() else None
+            failed = False
+            try:
+                return attr(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                metrics.record_bot_call(name, time.perf_counter() - start if start is not None else None, failed)
+        setattr(self, name, call)  # Later calls find the wrapper without going through __getattr__
+        return call
+
+
+def instrumented_callback(callback, state):
+    """Wrap a handler callback so its calls, errors, latency and state transitions reach `metrics`."""
+    def wrapper(update, context):
+        if metrics is None:
+            return callback(update, context)
+        start = time.perf_counter() if metrics.sample() else None
+        try:
+            next_state = callback(update, context)
+        except Exception:
+            metrics.inc("handler_errors_total", (("handler", callback.__name__),))
+            raise
+        latency = time.perf_counter() - start if start is not None else None
+        metrics.record_handler(callback.__name__, state, next_state, latency)
+        return next_state
+    wrapper.instrumented = True
+    return wrapper
+
+def registered_handlers(dispatcher):
+    """(state, handler) for every handler registered on the dispatcher, including each conversation state's."""
+    from telegram.ext import ConversationHandler
+
+    for group in dispatcher.handlers.values():
+        for handler in group:
+            if isinstance(handler, ConversationHandler):
+                yield from ((None, h) for h in handler.entry_points + handler.fallbacks)
+                yield from ((state, h) for state, handlers in handler.states.items() for h in handlers)
+            else:
+                yield None, handler
+
+def instrument_handlers(dispatcher):
+    """Wrap every handler registered on the dispatcher, including each conversation state's."""
+    for state, handler in registered_handlers(dispatcher):
+        if not getattr(handler.callback, "instrumented", False):
+            handler.callback = instrumented_callback(handler.callback, state)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, metrics, listen=METRICS_LISTEN, port=METRICS_PORT):
+        super().__init__((listen, port), MetricsRequestHandler)
+        self.metrics = metrics
+
 
 # Common functions
-def start_conversation(update: Update, text: str, next_state: int, reply_markup=None):
-    update.message.reply_text(text, reply_markup=reply_markup)
+def reply(update: "Update", text: str, reply_markup=None):
+    message_sender.send(update.effective_chat.id, text, reply_markup=reply_markup)
+
+def start_conversation(update: "Update", text: str, next_state: int, reply_markup=None):
+    reply(update, text, reply_markup=reply_markup)
     return next_state
 
-def get_user_data(update: Update) -> dict:
+# Profiles read by the handler running on this thread; queued for writing once it returns
+_handler_profiles = threading.local()
+
+def get_user_data(update: "Update") -> UserProfile:
     user_id = update.effective_user.id
-    if user_id not in user_data_dict:
-        user_data_dict[user_id] = {}
-    return user_data_dict[user_id]
+    profile = profile_store.get(user_id)
+    if profile is None:
+        profile = UserProfile()
+        profile_store.put(user_id, profile)  # Later lookups during this update find the same profile
+    touched = getattr(_handler_profiles, "touched", None)
+    if touched is not None:
+        touched[user_id] = profile
+    else:
+        profile.updated = time.time()
+        profile_store.put(user_id, profile)  # Not called from a handler: queue it right away
+    return profile
+
+def saving_profiles(callback):
+    """Wrap a handler callback so the profiles it read are queued for writing after it has changed them.
+
+    Queueing them before would let a flush in between, e.g. the periodic one, write the old
+    values and mark the profile clean, losing the handler's changes.
+    """
+    @functools.wraps(callback)
+    def wrapper(update, context):
+        _handler_profiles.touched = touched = {}
+        try:
+            return callback(update, context)
+        finally:
+            _handler_profiles.touched = None
+            now = time.time()
+            for user_id, profile in touched.items():
+                profile.updated = now
+                profile_store.put(user_id, profile)
+    wrapper.saves_profiles = True
+    return wrapper
+
+ACTIVITY_FACTORS = {
+    'sedentary': 1.2,
+    'lightly active': 1.375,
+    'moderately active': 1.55,
+    'very active': 1.725,
+    'super active': 1.9
+}
+ACTIVITY_LEVELS = tuple(ACTIVITY_FACTORS)
+KCAL_PER_KG = 7700  # 1 kg of body weight ≈ 7700 calories
+
+# Batch calculations: each argument is a sequence or array with one entry per user
+def calculate_bmr_batch(age, gender, weight, height) -> "np.ndarray":
+    import numpy as np
+
+    age = np.asarray(age, dtype=np.float64)
+    weight = np.asarray(weight, dtype=np.float64)
+    height = np.asarray(height, dtype=np.float64)
+    male = 88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age)
+    female = 447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age)
+    return np.where(np.asarray(gender) == 'male', male, female)
+
+def calculate_tdee_batch(bmr, activity_level) -> "np.ndarray":
+    """`activity_level` holds level names, or integer indexes into ACTIVITY_LEVELS."""
+    import numpy as np
 
+    activity = np.asarray(activity_level)
+    if activity.dtype.kind in 'iu':
+        return np.asarray(bmr, dtype=np.float64) * np.array(list(ACTIVITY_FACTORS.values()))[activity]
+    factors = np.full(activity.shape, 1.2)  # Unknown levels count as sedentary
+    unmatched = np.ones(activity.shape, dtype=bool)
+    for level, factor in ACTIVITY_FACTORS.items():
+        mask = activity == level
+        factors[mask] = factor
+        unmatched &= ~mask
+    if unmatched.any():
+        # Only names that are not already lower case pay for the conversion
+        lowered = np.char.lower(activity[unmatched].astype(str))
+        factors[unmatched] = [ACTIVITY_FACTORS.get(level, 1.2) for level in lowered]
+    return np.asarray(bmr, dtype=np.float64) * factors
+
+def calculate_daily_calories_batch(tdee, weight_loss_goal) -> "np.ndarray":
+    import numpy as np
+
+    return np.asarray(tdee, dtype=np.float64) - (np.asarray(weight_loss_goal, dtype=np.float64) * KCAL_PER_KG) / 7
+
+def calculate_plan_batch(age, gender, weight, height, activity_level, weight_loss_goal):
+    """Return (tdee, daily_calories) arrays for a whole set of profiles at once."""
+    tdee = calculate_tdee_batch(calculate_bmr_batch(age, gender, weight, height), activity_level)
+    return tdee, calculate_daily_calories_batch(tdee, weight_loss_goal)
+
+# One profile: the same formulas in plain Python, as a one-element array costs ~50x more than the arithmetic.
+# benchmarks/plan_batch.py checks that both give identical results
 def calculate_bmr(age, gender, weight, height):
     if gender == 'male':
         return 88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age)
     return 447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age)
 
 def calculate_tdee(bmr, activity_level):
-    activity_factors = {
-        'sedentary': 1.2,
-        'lightly active': 1.375,
-        'moderately active': 1.55,
-        'very active': 1.725,
-        'super active': 1.9
+    return bmr * ACTIVITY_FACTORS.get(activity_level.lower(), 1.2)
+
+def calculate_daily_calories(tdee, weight_loss_goal):
+    return tdee - (weight_loss_goal * KCAL_PER_KG) / 7
+
+PLAN_FIELDS = ('age', 'gender', 'weight', 'height', 'activity_level', 'weight_loss_goal')
+
+def calculate_plan(user_data: UserProfile):
+    """Return (tdee, daily_calories) for a complete profile."""
+    bmr = calculate_bmr(user_data['age'], user_data['gender'], user_data['weight'], user_data['height'])
+    tdee = calculate_tdee(bmr, user_data['activity_level'])
+    return tdee, calculate_daily_calories(tdee, user_data['weight_loss_goal'])
+
+# Input validation, shared by the step handlers and /plan; each raises ValueError on bad input
+def parse_age(text: str) -> int:
+    age = int(text)
+    if age > 120 or age < 10:
+        raise ValueError(f"age out of range: {age}")
+    return age
+
+def parse_height(text: str) -> float:
+    height = float(text)
+    if height > 250 or height < 50:
+        raise ValueError(f"height out of range: {height}")
+    return height
+
+def parse_weight(text: str) -> float:
+    weight = float(text)
+    if weight > 180 or weight < 30:
+        raise ValueError(f"weight out of range: {weight}")
+    return weight
+
+def parse_weigh_in(text: str) -> float:
+    # A weigh-in may carry a unit or a decimal comma, e.g. "79,5 kg"
+    return parse_weight(text.lower().replace(",", ".").replace("kg", "").replace("кг", "").strip())
+
+def parse_weight_loss_goal(text: str) -> float:
+    # Goals above 1 kg are valid input but get a warning instead of a plan
+    weight_loss_goal = float(text)
+    if weight_loss_goal <= 0:
+        raise ValueError(f"weight loss goal must be positive: {weight_loss_goal}")
+    return weight_loss_goal
+
+def parse_plan(args, language_options: Locale) -> dict:
+    """Parse `/plan <age> <gender> <height> <weight> <activity...> <goal>` in the given language."""
+    if len(args) < 6:
+        raise ValueError("not enough arguments")
+    gender = language_options.genders.get(normalize_input(args[1]))
+    activity = language_options.activities.get(normalize_input(" ".join(args[4:-1])))
+    if gender is None or activity is None:
+        raise ValueError("unknown gender or activity level")
+    return {
+        'age': parse_age(args[0]),
+        'gender': gender,
+        'height': parse_height(args[2]),
+        'weight': parse_weight(args[3]),
+        'activity_level': activity,
+        'weight_loss_goal': parse_weight_loss_goal(args[-1]),
     }
-    return bmr * activity_factors.get(activity_level.lower(), 1.2)
 
 # Conversation Handlers
-def start(update: Update, context: CallbackContext):
+def start(update: "Update", context: "CallbackContext"):
     user = update.effective_user
     user_data = get_user_data(update)
     user_data['language'] = "en"  # Default to English
     user_data['invalid_attempts'] = 0  # Track invalid attempts
-    language_options = LANGUAGE_OPTIONS[user_data['language']]
-
-    keyboard = language_options["language_options"]
-    reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+    language_options = LOCALES[user_data['language']]
 
-    return start_conversation(update, language_options["choose_language"], LANGUAGE, reply_markup=reply_markup)
+    return start_conversation(update, language_options["choose_language"], LANGUAGE, reply_markup=LANGUAGE_KEYBOARD)
 
-def language(update: Update, context: CallbackContext):
+def language(update: "Update", context: "CallbackContext"):
     user_data = get_user_data(update)
-    chosen_language = update.message.text.lower()
-
-    if "english" in chosen_language:
-        user_data['language'] = "en"
-    elif "русский" in chosen_language:
-        user_data['language'] = "ru"
-    else:
+    chosen_language = normalize_input(update.message.text)
+    code = LANGUAGES_BY_NAME.get(chosen_language)
+    if code is None:
+        # Also accept a language name inside a longer message, e.g. "English please"
+        code = next((code for name, code in LANGUAGES_BY_NAME.items() if name in chosen_language), None)
+    if code is None:
         return start_conversation(update, "Please choose a valid language option:", LANGUAGE)
+    user_data['language'] = code
 
-    language_options = LANGUAGE_OPTIONS[user_data['language']]
+    language_options = LOCALES[user_data['language']]
     return start_conversation(update, language_options["age_prompt"], AGE)
 
-def age(update: Update, context: CallbackContext):
+def age(update: "Update", context: "CallbackContext"):
     user_data = get_user_data(update)
-    language_options = LANGUAGE_OPTIONS[user_data['language']]
+    language_options = LOCALES[user_data['language']]
 
     try:
-        age = int(update.message.text)
-        if age > 120 or age < 10:
-            user_data['invalid_attempts'] += 1
-            if user_data['invalid_attempts'] >= 3:
-                return ask_restart(update, context)
-            return start_conversation(update, language_options["age_error"], AGE)
-
+        age = parse_age(update.message.text)
         user_data['age'] = age
         user_data['invalid_attempts'] = 0  # Reset invalid attempts
-        keyboard = [["Male", "Female"]] if user_data['language'] == "en" else [["Мужской", "Женский"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-        return start_conversation(update, language_options["gender_prompt"], GENDER, reply_markup=reply_markup)
+        return start_conversation(update, language_options["gender_prompt"], GENDER,
+                                  reply_markup=language_options.keyboards["gender"])
 
     except ValueError:
         user_data['invalid_attempts'] += 1
@@ -198,38 +1785,28 @@ def age(update: Update, context: CallbackContext):
             return ask_restart(update, context)
         return start_conversation(update, language_options["age_error"], AGE)
 
-def gender(update: Update, context: CallbackContext):
+def gender(update: "Update", context: "CallbackContext"):
     user_data = get_user_data(update)
-    language_options = LANGUAGE_OPTIONS[user_data['language']]
-    gender_input = update.message.text.lower()
+    language_options = LOCALES[user_data['language']]
+    gender_input = language_options.genders.get(normalize_input(update.message.text))
 
-    if user_data['language'] == "en" and gender_input in ["male", "female"]:
-        user_data['gender'] = gender_input
-    elif user_data['language'] == "ru" and gender_input in ["мужской", "женский"]:
-        user_data['gender'] = "male" if gender_input == "мужской" else "female"
-    else:
+    if gender_input is None:
         user_data['invalid_attempts'] += 1
         if user_data['invalid_attempts'] >= 3:
             return ask_restart(update, context)
-        keyboard = [["Male", "Female"]] if user_data['language'] == "en" else [["Мужской", "Женский"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-        return start_conversation(update, language_options["gender_error"], GENDER, reply_markup=reply_markup)
+        return start_conversation(update, language_options["gender_error"], GENDER,
+                                  reply_markup=language_options.keyboards["gender"])
 
+    user_data['gender'] = gender_input
     user_data['invalid_attempts'] = 0  # Reset invalid attempts
     return start_conversation(update, language_options["height_prompt"], HEIGHT)
 
-def height(update: Update, context: CallbackContext):
+def height(update: "Update", context: "CallbackContext"):
     user_data = get_user_data(update)
-    language_options = LANGUAGE_OPTIONS[user_data['language']]
+    language_options = LOCALES[user_data['language']]
 
     try:
-        height = float(update.message.text)
-        if height > 250 or height < 50:
-            user_data['invalid_attempts'] += 1
-            if user_data['invalid_attempts'] >= 3:
-                return ask_restart(update, context)
-            return start_conversation(update, language_options["height_error"], HEIGHT)
-
+        height = parse_height(update.message.text)
         user_data['height'] = height
         user_data['invalid_attempts'] = 0  # Reset invalid attempts
         return start_conversation(update, language_options["weight_prompt"], WEIGHT)
@@ -240,29 +1817,16 @@ def height(update: Update, context: CallbackContext):
             return ask_restart(update, context)
         return start_conversation(update, language_options["height_error"], HEIGHT)
 
-def weight(update: Update, context: CallbackContext):
+def weight(update: "Update", context: "CallbackContext"):
     user_data = get_user_data(update)
-    language_options = LANGUAGE_OPTIONS[user_data['language']]
+    language_options = LOCALES[user_data['language']]
 
     try:
-        weight = float(update.message.text)
-        if weight > 180 or weight < 30:
-            user_data['invalid_attempts'] += 1
-            if user_data['invalid_attempts'] >= 3:
-                return ask_restart(update, context)
-            return start_conversation(update, language_options["weight_error"], WEIGHT)
-
+        weight = parse_weight(update.message.text)
         user_data['weight'] = weight
         user_data['invalid_attempts'] = 0  # Reset invalid attempts
-        keyboard = [["Sedentary", "Lightly Active"], ["Moderately Active", "Very Active", "Super Active"]] \
-            if user_data['language'] == "en" else \
-            [["Сидячий", "Малоактивный"], ["Умеренно активный", "Очень активный", "Суперактивный"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-
-        # Show a nutrition tip
-        update.message.reply_text(language_options["nutrition_tip"] + random.choice(NUTRITION_TIPS[user_data['language']]))
-
-        return start_conversation(update, language_options["activity_prompt"], ACTIVITY_LEVEL, reply_markup=reply_markup)
+        return start_conversation(update, language_options["activity_prompt"], ACTIVITY_LEVEL,
+                                  reply_markup=language_options.keyboards["activity"])
 
     except ValueError:
         user_data['invalid_attempts'] += 1
@@ -270,70 +1834,53 @@ def weight(update: Update, context: CallbackContext):
             return ask_restart(update, context)
         return start_conversation(update, language_options["weight_error"], WEIGHT)
 
-def activity_level(update: Update, context: CallbackContext):
+def activity_level(update: "Update", context: "CallbackContext"):
     user_data = get_user_data(update)
-    language_options = LANGUAGE_OPTIONS[user_data['language']]
-    activity_input = update.message.text.lower()
-    valid_activities = ["sedentary", "lightly active", "moderately active", "very active", "super active"] \
-        if user_data['language'] == "en" else \
-        ["сидячий", "малоактивный", "умеренно активный", "очень активный", "суперактивный"]
+    language_options = LOCALES[user_data['language']]
+    activity_input = language_options.activities.get(normalize_input(update.message.text))
 
-    if activity_input in valid_activities:
+    if activity_input is not None:
         user_data['activity_level'] = activity_input
         user_data['invalid_attempts'] = 0  # Reset invalid attempts
-
-        # Show a nutrition tip
-        update.message.reply_text(language_options["nutrition_tip"] + random.choice(NUTRITION_TIPS[user_data['language']]))
-
         return start_conversation(update, language_options["weight_loss_goal_prompt"], WEIGHT_LOSS_GOAL)
     else:
         user_data['invalid_attempts'] += 1
         if user_data['invalid_attempts'] >= 3:
             return ask_restart(update, context)
-        keyboard = [["Sedentary", "Lightly Active"], ["Moderately Active", "Very Active", "Super Active"]] \
-            if user_data['language'] == "en" else \
-            [["Сидячий", "Малоактивный"], ["Умеренно активный", "Очень активный", "Суперактивный"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-        return start_conversation(update, language_options["activity_error"], ACTIVITY_LEVEL, reply_markup=reply_markup)
+        return start_conversation(update, language_options["activity_error"], ACTIVITY_LEVEL,
+                                  reply_markup=language_options.keyboards["activity"])
 
-def weight_loss_goal(update: Update, context: CallbackContext):
+def weight_loss_goal(update: "Update", context: "CallbackContext"):
     user_data = get_user_data(update)
-    language_options = LANGUAGE_OPTIONS[user_data['language']]
+    language_options = LOCALES[user_data['language']]
 
     try:
-        weight_loss_goal = float(update.message.text)
+        weight_loss_goal = parse_weight_loss_goal(update.message.text)
         if weight_loss_goal > 1:
             return start_conversation(update, language_options["weight_loss_goal_warning"], WEIGHT_LOSS_GOAL)
-        elif weight_loss_goal <= 0:
-            user_data['invalid_attempts'] += 1
-            if user_data['invalid_attempts'] >= 3:
-                return ask_restart(update, context)
-            return start_conversation(update, language_options["weight_loss_goal_error"], WEIGHT_LOSS_GOAL)
 
         user_data['weight_loss_goal'] = weight_loss_goal
         user_data['invalid_attempts'] = 0  # Reset invalid attempts
+        if not all(field in user_data for field in PLAN_FIELDS):
+            return ask_restart(update, context)  # Earlier answers are missing, e.g. lost in a crash
 
-        # Calculate BMR and TDEE
-        bmr = calculate_bmr(user_data['age'], user_data['gender'], user_data['weight'], user_data['height'])
-        tdee = calculate_tdee(bmr, user_data['activity_level'])
-
-        # Convert weight loss goal from kg to calories (1 kg ≈ 7700 calories)
-        daily_calories = tdee - (weight_loss_goal * 7700) / 7
+        # Calculate TDEE and the calorie target for the weight loss goal
+        tdee, daily_calories = calculate_plan(user_data)
+        record_plan(update, user_data, tdee, daily_calories)
 
         # Show diet plan
-        update.message.reply_text(
+        reply(
+            update,
             language_options["diet_plan_ready"].format(int(tdee), int(daily_calories)),
-            reply_markup=ReplyKeyboardRemove()
+            reply_markup=REMOVE_KEYBOARD
         )
 
-        # Provide option to recalculate
-        keyboard = [[language_options["recalculate_button"]]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-
         # Schedule weekly progress reminders
-        job_queue.run_repeating(send_progress_reminder, interval=604800, first=604800, context=update.message.chat_id)
+        reminder_scheduler.schedule(update.message.chat_id)
 
-        return start_conversation(update, language_options["recalculate_prompt"], DONE, reply_markup=reply_markup)
+        # Provide option to recalculate
+        return start_conversation(update, language_options["recalculate_prompt"], DONE,
+                                  reply_markup=language_options.keyboards["recalculate"])
 
     except ValueError:
         user_data['invalid_attempts'] += 1
@@ -341,75 +1888,571 @@ def weight_loss_goal(update: Update, context: CallbackContext):
             return ask_restart(update, context)
         return start_conversation(update, language_options["weight_loss_goal_error"], WEIGHT_LOSS_GOAL)
 
-def ask_restart(update: Update, context: CallbackContext):
+def ask_restart(update: "Update", context: "CallbackContext"):
     user_data = get_user_data(update)
-    language_options = LANGUAGE_OPTIONS[user_data['language']]
-
-    keyboard = language_options["restart_options"]
-    reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+    language_options = LOCALES[user_data['language']]
 
     # Present a summary of the previously entered valid data
     summary = "\n".join([f"{key.capitalize()}: {value}" for key, value in user_data.items() if key != 'language' and key != 'invalid_attempts'])
 
-    update.message.reply_text(
+    reply(
+        update,
         f"{language_options['restart_prompt']}\n\n{summary}",
-        reply_markup=reply_markup
+        reply_markup=language_options.keyboards["restart"]
     )
 
     return RESTART
 
-def restart(update: Update, context: CallbackContext):
+def restart(update: "Update", context: "CallbackContext"):
     user_data = get_user_data(update)
-    choice = update.message.text.lower()
+    choice = RESTART_CHOICES.get(normalize_input(update.message.text))
 
-    if choice in ["start over", "начать сначала"]:
+    if choice == "start over":
         return start(update, context)
-    elif choice in ["use previous", "использовать предыдущие"]:
+    elif choice == "use previous":
         # Restart the process using previous data, starting from weight_loss_goal step
         return weight_loss_goal(update, context)
     else:
-        return start_conversation(update, LANGUAGE_OPTIONS[user_data['language']]["invalid_input"], RESTART)
+        return start_conversation(update, LOCALES[user_data['language']]["invalid_input"], RESTART)
 
-def done(update: Update, context: CallbackContext):
+def done(update: "Update", context: "CallbackContext"):
     return start(update, context)  # Restart the process
 
-def cancel(update: Update, context: CallbackContext):
+def cancel(update: "Update", context: "CallbackContext"):
+    user_data = get_user_data(update)
+    language_options = LOCALES[user_data['language']]
+    reply(update, language_options["cancel"], reply_markup=REMOVE_KEYBOARD)
+    return END
+
+def fallback(update: "Update", context: "CallbackContext"):
+    user_data = get_user_data(update)
+    language_options = LOCALES[user_data['language']]
+    reply(update, language_options["invalid_input"])
+
+def plan(update: "Update", context: "CallbackContext"):
+    """/plan with every answer in one message: one reply instead of the step-by-step conversation."""
     user_data = get_user_data(update)
-    language_options = LANGUAGE_OPTIONS[user_data['language']]
-    update.message.reply_text(language_options["cancel"], reply_markup=ReplyKeyboardRemove())
-    return ConversationHandler.END
+    # Try the user's language first, then the others
+    candidates = sorted(LOCALES.values(), key=lambda locale: locale.code != user_data['language'])
+    for language_options in candidates:
+        try:
+            values = parse_plan(context.args, language_options)
+            break
+        except ValueError:
+            continue
+    else:
+        return reply(update, LOCALES[user_data['language']]["plan_usage"])
+
+    if values['weight_loss_goal'] > 1:
+        return reply(update, language_options["weight_loss_goal_warning"])
+
+    user_data['language'] = language_options.code
+    for key, value in values.items():
+        user_data[key] = value
+    user_data['invalid_attempts'] = 0
+
+    tdee, daily_calories = calculate_plan(user_data)
+    record_plan(update, user_data, tdee, daily_calories)
+    reply(update, language_options["diet_plan_ready"].format(int(tdee), int(daily_calories)), reply_markup=REMOVE_KEYBOARD)
+    reminder_scheduler.schedule(update.message.chat_id)
+
+def record_plan(update: "Update", user_data: UserProfile, tdee, daily_calories):
+    """The weight a plan was made for is also a weigh-in; a plan also subscribes the chat to the daily tips."""
+    series = weight_log.add(update.effective_user.id, user_data['weight'])
+    series.tdee, series.daily_calories = tdee, daily_calories
+    tip_rotation.subscribe(update.effective_chat.id, user_data['language'])
 
-def fallback(update: Update, context: CallbackContext):
+def progress_summary(series: Optional[WeightSeries], user_data: UserProfile, language_options: Locale) -> str:
+    """Summary from the series' running aggregates; nothing here walks the history."""
+    if series is None:
+        return language_options["progress_empty"]
+    lines = [language_options["progress_summary"].format(count=len(series), latest=series.latest,
+                                                         average=series.average, change=series.latest - series.first)]
+    trend = series.trend
+    if trend is not None:
+        lines.append(language_options["progress_trend"].format(trend * 7))
+    if series.tdee is None and all(key in user_data for key in PLAN_FIELDS):
+        series.tdee, series.daily_calories = calculate_plan(user_data)
+    if series.tdee is not None:
+        lines.append(language_options["progress_plan"].format(int(series.tdee), int(series.daily_calories)))
+    return "\n".join(lines)
+
+def log_weight(update: "Update", context: "CallbackContext"):
+    """A weigh-in sent as a bare number, e.g. in answer to the progress reminder; keeps the conversation state."""
+    record_weigh_in(update, update.message.text)
+
+def progress(update: "Update", context: "CallbackContext"):
+    """/progress shows the summary; /progress <kg> logs a weigh-in first."""
+    if context.args:
+        return record_weigh_in(update, " ".join(context.args))
     user_data = get_user_data(update)
-    language_options = LANGUAGE_OPTIONS[user_data['language']]
-    update.message.reply_text(language_options["invalid_input"])
-
-def send_progress_reminder(context: CallbackContext):
-    chat_id = context.job.context
-    user_data = user_data_dict.get(chat_id, {})
-    language_options = LANGUAGE_OPTIONS[user_data.get('language', 'en')]
-    context.bot.send_message(chat_id=chat_id, text=language_options["progress_reminder"])
-
-# Setup conversation handler
-conversation_handler = ConversationHandler(
-    entry_points=[CommandHandler('start', start)],
-    states={
-        LANGUAGE: [MessageHandler(Filters.text & ~Filters.command, language)],
-        AGE: [MessageHandler(Filters.text & ~Filters.command, age)],
-        GENDER: [MessageHandler(Filters.text & ~Filters.command, gender)],
-        HEIGHT: [MessageHandler(Filters.text & ~Filters.command, height)],
-        WEIGHT: [MessageHandler(Filters.text & ~Filters.command, weight)],
-        ACTIVITY_LEVEL: [MessageHandler(Filters.text & ~Filters.command, activity_level)],
-        WEIGHT_LOSS_GOAL: [MessageHandler(Filters.text & ~Filters.command, weight_loss_goal)],
-        DONE: [MessageHandler(Filters.text & ~Filters.command, done)],
-        RESTART: [MessageHandler(Filters.text & ~Filters.command, restart)],
-    },
-    fallbacks=[MessageHandler(Filters.text & ~Filters.command, fallback), CommandHandler('cancel', cancel)],
-)
-
-# Add the handlers to the dispatcher
-dispatcher.add_handler(conversation_handler)
-
-# Start the bot
-updater.start_polling()
-updater.idle()
+    language_options = LOCALES[user_data['language']]
+    reply(update, progress_summary(weight_log.get(update.effective_user.id), user_data, language_options))
+
+def record_weigh_in(update: "Update", text: str):
+    user_data = get_user_data(update)
+    language_options = LOCALES[user_data['language']]
+    try:
+        weight = parse_weigh_in(text)
+    except ValueError:
+        return reply(update, language_options["weight_error"])
+    series = weight_log.add(update.effective_user.id, weight)
+    user_data['weight'] = round(series.average, 1)  # Plans follow the rolling average, not a single weigh-in
+    reply(update, language_options["weight_logged"] + "\n\n" + progress_summary(series, user_data, language_options))
+
+def stop_messages(chat_id):
+    """No more tips or reminders for the chat, e.g. one that blocked the bot, until it finishes a new plan."""
+    tip_rotation.unsubscribe(chat_id)
+    reminder_scheduler.cancel(chat_id)
+
+def stop(update: "Update", context: "CallbackContext"):
+    """/stop unsubscribes the chat from the daily tips and the progress reminders."""
+    user_data = get_user_data(update)
+    stop_messages(update.effective_chat.id)
+    reply(update, LOCALES[user_data['language']]["stopped"], reply_markup=REMOVE_KEYBOARD)
+
+def progress_reminders(chat_ids):
+    """(chat_id, text) of each chat's progress reminder, in the chat's language."""
+    for chat_id in chat_ids:
+        user_data = profile_store.get(chat_id) or UserProfile()
+        yield chat_id, LOCALES[user_data.language]["progress_reminder"]
+
+def send_due_reminders(context: "CallbackContext"):
+    # Bulk traffic like the tip digest: replies to active users don't wait behind a tick's worth of reminders
+    message_sender.send_bulk(progress_reminders(reminder_scheduler.pop_due()))
+
+def tip_digest(chat_ids):
+    """(chat_id, text) of each chat's next tip; each rotation advances only when its message is drawn."""
+    tip_counts = {language: len(tips) for language, tips in NUTRITION_TIPS.items()}
+    for chat_id in chat_ids:
+        tip = tip_rotation.advance(chat_id, tip_counts)
+        if tip is None:
+            continue  # Unsubscribed since the digest started
+        language, index = tip
+        yield chat_id, LOCALES[language]["nutrition_tip"] + NUTRITION_TIPS[language][index]
+    tip_rotation.flush()
+
+def admit_update(update: "Update", context: "CallbackContext"):
+    """Runs ahead of every other handler and stops the update there unless admission control admits it now."""
+    from telegram.ext import DispatcherHandlerStop
+
+    verdict = admission_control.admit(update)
+    if verdict == "admitted":
+        return
+    if metrics:
+        if verdict == "held":
+            metrics.inc("updates_held_total")
+        else:
+            metrics.inc("updates_shed_total", (("reason", verdict),))
+    raise DispatcherHandlerStop
+
+def release_updates_to(put):
+    """Send the held updates admission control releases to `put`, the ingestion path in use.
+
+    They then wait behind the updates already queued and are handled by the thread or worker that
+    handles the rest of their chat, in order, rather than on the JobQueue thread.
+    """
+    if admission_control:
+        admission_control.release = put
+
+def release_held_updates(context: "CallbackContext"):
+    release = admission_control.release or context.dispatcher.update_queue.put
+    for update in admission_control.pop_due():
+        release(update)
+
+def send_tip_digest(context: "CallbackContext"):
+    # One batch for every subscribed chat, sent as bulk traffic behind the replies to active users
+    message_sender.send_bulk(tip_digest(tip_rotation.chats()))
+
+# Setup conversation handler, once telegram.ext is imported
+conversation_handler = None
+WEIGH_IN_PATTERN = r"^\s*\d{2,3}([.,]\d+)?\s*(kg|кг)?\s*$"
+
+def build_conversation_handler(persistent=False):
+    from telegram.ext import CommandHandler, ConversationHandler, Filters, MessageHandler
+
+    weigh_in = Filters.regex(WEIGH_IN_PATTERN) & ~Filters.command
+    return ConversationHandler(
+        name=CONVERSATION_NAME,
+        persistent=persistent,
+        allow_reentry=True,  # /start begins again from any step, e.g. one resumed without its earlier answers
+        entry_points=[CommandHandler('start', start)],
+        states={
+            LANGUAGE: [MessageHandler(Filters.text & ~Filters.command, language)],
+            AGE: [MessageHandler(Filters.text & ~Filters.command, age)],
+            GENDER: [MessageHandler(Filters.text & ~Filters.command, gender)],
+            HEIGHT: [MessageHandler(Filters.text & ~Filters.command, height)],
+            WEIGHT: [MessageHandler(Filters.text & ~Filters.command, weight)],
+            ACTIVITY_LEVEL: [MessageHandler(Filters.text & ~Filters.command, activity_level)],
+            WEIGHT_LOSS_GOAL: [MessageHandler(Filters.text & ~Filters.command, weight_loss_goal)],
+            DONE: [MessageHandler(weigh_in, log_weight), MessageHandler(Filters.text & ~Filters.command, done)],
+            RESTART: [MessageHandler(Filters.text & ~Filters.command, restart)],
+        },
+        fallbacks=[MessageHandler(Filters.text & ~Filters.command, fallback), CommandHandler('cancel', cancel)],
+    )
+
+def init_services(bot, profile_db_path=PROFILE_DB_PATH, reminder_db_path=REMINDER_DB_PATH, weight_db_path=WEIGHT_DB_PATH,
+                  tip_db_path=TIP_DB_PATH, metrics_sample_rate=METRICS_SAMPLE_RATE, admission_rate=ADMISSION_USER_RATE,
+                  admission_global_rate=ADMISSION_GLOBAL_RATE, **sender_options):
+    """Create the profile store, reminder scheduler, weight log, tip rotation, message sender, admission
+    control and metrics used by the handlers.
+
+    A `metrics_sample_rate` of None turns instrumentation off, an `admission_rate` of None admission control.
+    """
+    global profile_store, reminder_scheduler, weight_log, tip_rotation, message_sender, admission_control, metrics
+    load_localization()
+    profile_store = SQLiteProfileStore(profile_db_path) if profile_db_path else MemoryProfileStore()
+    reminder_scheduler = ReminderScheduler(reminder_db_path)
+    weight_log = WeightLog(weight_db_path)
+    tip_rotation = TipRotation(tip_db_path)
+    metrics = Metrics(metrics_sample_rate) if metrics_sample_rate is not None else None
+    message_sender = MessageSender(InstrumentedBot(bot, metrics) if metrics else bot, on_unreachable=stop_messages,
+                                   **sender_options)
+    admission_control = AdmissionControl(admission_rate, global_rate=admission_global_rate,
+                                         reply_pending=message_sender.pending) if admission_rate else None
+    if metrics:
+        metrics.add_gauge("conversation_state_users", "Users currently in each conversation state.",
+                          lambda: {(("state", STATE_NAMES.get(state, str(state))),): count for state, count in
+                                   Counter(list(conversation_handler.conversations.values())).items()})
+        metrics.add_gauge("send_queue_depth", "Outgoing messages waiting to be sent.",
+                          lambda: {(): message_sender.stats()["queue_depth"]})
+        if admission_control:
+            metrics.add_gauge("held_updates", "Updates held back by admission control.",
+                              lambda: {(): admission_control.stats()["held"]})
+
+def register_handlers(dispatcher):
+    from telegram import Update
+    from telegram.ext import CommandHandler, Filters, MessageHandler, TypeHandler
+
+    global conversation_handler
+    # Conversation state survives restarts when the dispatcher has a persistence
+    conversation_handler = build_conversation_handler(persistent=dispatcher.persistence is not None)
+    dispatcher.add_handler(conversation_handler)
+    dispatcher.add_handler(CommandHandler('plan', plan))
+    dispatcher.add_handler(CommandHandler('progress', progress))
+    dispatcher.add_handler(CommandHandler('stop', stop))
+    # Weigh-ins from users outside the conversation, e.g. after /plan
+    dispatcher.add_handler(MessageHandler(Filters.regex(WEIGH_IN_PATTERN) & ~Filters.command, log_weight))
+    for _, handler in registered_handlers(dispatcher):
+        if not getattr(handler.callback, "saves_profiles", False):
+            handler.callback = saving_profiles(handler.callback)
+    if metrics:
+        instrument_handlers(dispatcher)
+    if admission_control:
+        # Group -1 runs before the conversation; added after instrumentation as it counts what it sheds itself
+        dispatcher.add_handler(TypeHandler(Update, admit_update), group=-1)
+
+def schedule_jobs(job_queue):
+    # Write queued profile changes in the background
+    job_queue.run_repeating(lambda context: profile_store.flush(), interval=PROFILE_FLUSH_INTERVAL)
+
+    # Single timer for all weekly progress reminders
+    job_queue.run_repeating(send_due_reminders, interval=REMINDER_TICK, first=REMINDER_TICK)
+
+    # Daily nutrition tip for every subscribed chat
+    job_queue.run_daily(send_tip_digest, SCHEDULE_TIME)
+
+    # Hand updates held back by admission control to the dispatcher once their user's turn comes
+    if admission_control:
+        job_queue.run_repeating(release_held_updates, interval=ADMISSION_TICK, first=ADMISSION_TICK)
+
+def close_services(persistence=None):
+    message_sender.stop(timeout=30)
+    profile_store.close()
+    weight_log.close()
+    tip_rotation.close()
+    if persistence:
+        persistence.flush()
+
+# App factory
+def create_bot(token=TOKEN):
+    from telegram import Bot
+    from telegram.utils.request import Request
+
+    # Connections for the sender threads, polling, the job queue and the main thread
+    return Bot(token, request=Request(con_pool_size=SEND_WORKERS + 4))
+
+def create_app(bot, persistence=None, workers=4, **service_options):
+    """Build a dispatcher for `bot` with the services, handlers and jobs of the bot; nothing is started yet.
+
+    `service_options` go to init_services(). Building an app makes no network calls, so tools,
+    benchmarks and freshly started workers can create one cheaply.
+    """
+    from telegram.ext import Dispatcher, JobQueue
+
+    init_services(bot, **service_options)
+    if isinstance(persistence, ConversationJournal):
+        persistence.use_profile_store(profile_store)
+    job_queue = JobQueue()
+    dispatcher = Dispatcher(bot, Queue(), workers=workers, persistence=persistence, job_queue=job_queue)
+    job_queue.set_dispatcher(dispatcher)
+    register_handlers(dispatcher)
+    schedule_jobs(job_queue)
+    return dispatcher
+
+# Sharded deployment
+def shard_for(chat_id, shards) -> int:
+    return chat_id % shards if chat_id is not None else 0
+
+def shard_path(path, index):
+    """Per-shard file name, e.g. profiles.db -> profiles.shard2.db; None stays None."""
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index}{ext}"
+
+def run_shard(index, shards, bot_factory, updates, processed, profile_db_path=PROFILE_DB_PATH,
+              reminder_db_path=REMINDER_DB_PATH, weight_db_path=WEIGHT_DB_PATH, tip_db_path=TIP_DB_PATH,
+              state_journal_path=STATE_JOURNAL_PATH, **sender_options):
+    """Worker process: owns the profiles, weigh-ins, tips, conversation state and reminders of the chats routed to it."""
+    from telegram import Update
+
+    bot = bot_factory()
+    journal_path = shard_path(state_journal_path, index)
+    persistence = journal_persistence(journal_path) if journal_path else None
+    dispatcher = create_app(bot, persistence, workers=1, profile_db_path=shard_path(profile_db_path, index),
+                            reminder_db_path=shard_path(reminder_db_path, index),
+                            weight_db_path=shard_path(weight_db_path, index),
+                            tip_db_path=shard_path(tip_db_path, index),
+                            metrics_sample_rate=METRICS_SAMPLE_RATE if METRICS_PORT else None,
+                            **{"global_rate": SEND_GLOBAL_RATE / shards,  # Shards share the global limits
+                               "admission_global_rate": ADMISSION_GLOBAL_RATE / shards, **sender_options})
+    if metrics:
+        metrics_server = MetricsServer(metrics, port=METRICS_PORT + 1 + index)
+        threading.Thread(target=metrics_server.serve_forever, name="metrics", daemon=True).start()
+    release_updates_to(lambda update: updates.put(update.to_json()))  # Back into this shard's queue
+    dispatcher.job_queue.start()
+    message_sender.start()
+    while True:
+        payload = updates.get()
+        if payload is None:
+            break
+        try:
+            dispatcher.process_update(Update.de_json(json.loads(payload), bot))
+        except Exception:
+            logger.exception("Error while processing update on shard %d", index)
+        with processed.get_lock():
+            processed[index] += 1
+    dispatcher.job_queue.stop()
+    close_services(persistence)
+
+
+class ShardRouter:
+    """Front-process side of a sharded deployment: one worker process per shard, chats routed by chat_id.
+
+    Each shard has one FIFO queue and processes it in order, so a chat's updates never interleave.
+    Implements the UpdateWorkerPool interface, so it can stand in as the webhook server's pool, and
+    `put`, so it can stand in as the polling Updater's update queue.
+    """
+
+    def __init__(self, bot_factory, shards=SHARD_COUNT, queue_size=SHARD_QUEUE_SIZE, **shard_options):
+        import multiprocessing
+
+        # Fork so workers inherit bot_factory without pickling; start() must run before any threads do
+        self._context = multiprocessing.get_context("fork")
+        self.shards = shards
+        self.bot_factory = bot_factory
+        self.shard_options = shard_options
+        self.processed = self._context.Array("q", shards)
+        self._queues = [self._context.Queue(queue_size) for _ in range(shards)]
+        self._processes = []
+        self.started = None
+        self.received = 0
+        self.rejected = 0
+
+    def start(self):
+        self.started = time.monotonic()
+        for index, queue in enumerate(self._queues):
+            process = self._context.Process(target=run_shard, name=f"shard-{index}", daemon=True,
+                                            args=(index, self.shards, self.bot_factory, queue, self.processed),
+                                            kwargs=self.shard_options)
+            process.start()
+            self._processes.append(process)
+
+    def stop(self):
+        """Let every worker finish its queue, then wait for it to exit."""
+        for queue in self._queues:
+            queue.put(None)
+        for process in self._processes:
+            process.join()
+        self._processes = []
+
+    def submit(self, update, block=False) -> bool:
+        chat = update.effective_chat
+        return self.submit_json(chat.id if chat else None, update.to_json(), block)
+
+    def submit_json(self, chat_id, payload, block=False) -> bool:
+        self.received += 1
+        try:
+            self._queues[shard_for(chat_id, self.shards)].put(payload, block)
+        except Full:
+            self.rejected += 1
+            return False
+        return True
+
+    def put(self, update):
+        from telegram import Update
+
+        if isinstance(update, Update):
+            self.submit(update, block=True)
+        else:
+            logger.error("Error while getting updates: %s", update)
+
+    def stats(self) -> dict:
+        processed = sum(self.processed)
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        return {
+            "shards": self.shards,
+            "received": self.received,
+            "processed": processed,
+            "processed_per_shard": list(self.processed),
+            "rejected": self.rejected,
+            "updates_per_sec": processed / elapsed if elapsed else 0.0,
+        }
+
+
+def rebalance_shards(old_shards, new_shards, profile_db_path=PROFILE_DB_PATH, reminder_db_path=REMINDER_DB_PATH,
+                     weight_db_path=WEIGHT_DB_PATH, tip_db_path=TIP_DB_PATH, state_journal_path=STATE_JOURNAL_PATH):
+    """Move profiles, weigh-ins, tip rotations, reminders and conversation state from `old_shards` shard files to `new_shards`.
+
+    Run it while the bot is stopped. New files are written next to the old ones and swapped in at
+    the end. Profiles are keyed by user id, which is the chat id in private chats.
+    """
+    def paths(path, shards):
+        return [path] if shards == 1 else [shard_path(path, index) for index in range(shards)]
+
+    def staged(path):
+        return path + ".rebalance" if path else path
+
+    if profile_db_path:
+        targets = [SQLiteProfileStore(staged(path)) for path in paths(profile_db_path, new_shards)]
+        for path in paths(profile_db_path, old_shards):
+            if os.path.exists(path):
+                source = SQLiteProfileStore(path)
+                for user_id, profile in source.items():
+                    targets[shard_for(user_id, new_shards)].put(user_id, profile)
+                source.close()
+        for target in targets:
+            target.close()
+    if reminder_db_path:
+        targets = [ReminderScheduler(staged(path)) for path in paths(reminder_db_path, new_shards)]
+        for path in paths(reminder_db_path, old_shards):
+            if os.path.exists(path):
+                for chat_id, due in ReminderScheduler(path).due_times().items():
+                    targets[shard_for(chat_id, new_shards)].schedule(chat_id, first=0, now=due)
+    if weight_db_path:
+        targets = [WeightLog(staged(path)) for path in paths(weight_db_path, new_shards)]
+        for path in paths(weight_db_path, old_shards):
+            if os.path.exists(path):
+                source = WeightLog(path)
+                for user_id, day, weight in source.entries():
+                    targets[shard_for(user_id, new_shards)].add(user_id, weight, now=day * 86400)
+                source.close()
+        for target in targets:
+            target.close()
+    if tip_db_path:
+        targets = [TipRotation(staged(path)) for path in paths(tip_db_path, new_shards)]
+        for path in paths(tip_db_path, old_shards):
+            if os.path.exists(path):
+                source = TipRotation(path)
+                for chat_id, *state in source.entries():
+                    targets[shard_for(chat_id, new_shards)].restore(chat_id, *state)
+                source.close()
+        for target in targets:
+            target.close()
+    if state_journal_path:
+        targets = [ConversationJournal(staged(path)) for path in paths(state_journal_path, new_shards)]
+        for path in paths(state_journal_path, old_shards):
+            source = ConversationJournal(path)
+            for key, state, values in source.entries(CONVERSATION_NAME):
+                targets[shard_for(key[0], new_shards)].restore(CONVERSATION_NAME, key, state, values)
+            source.flush()
+        for target in targets:
+            target.flush()
+
+    # Swap the staged files in
+    for path, suffixes in ((profile_db_path, ("",)), (reminder_db_path, ("",)), (weight_db_path, ("",)),
+                           (tip_db_path, ("",)), (state_journal_path, (".snapshot", ".journal", ".journal.old"))):
+        if not path:
+            continue
+        for old_path in paths(path, old_shards):
+            for suffix in suffixes + ("-wal", "-shm"):
+                if os.path.exists(old_path + suffix):
+                    os.remove(old_path + suffix)
+        for new_path in paths(path, new_shards):
+            for suffix in suffixes:
+                if os.path.exists(staged(new_path) + suffix):
+                    os.replace(staged(new_path) + suffix, new_path + suffix)
+
+
+def run_sharded():
+    from telegram.ext import Updater
+
+    router = ShardRouter(create_bot)
+    updater = Updater(bot=create_bot(), use_context=True)
+    if INGESTION_MODE == "webhook":
+        webhook_server = WebhookServer(updater.dispatcher, pool=router)
+        if WEBHOOK_URL:
+            updater.bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=webhook_server.secret_token)
+        try:
+            webhook_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        webhook_server.server_close()
+    else:
+        router.start()
+        updater.update_queue = router  # Polling hands each update to its shard
+        updater.start_polling()
+        updater.idle()
+        router.stop()
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "rebalance":
+        # python calorie-compass.py rebalance <old shard count> <new shard count>
+        return rebalance_shards(int(sys.argv[2]), int(sys.argv[3]))
+    if INGESTION_MODE == "webhook" and not WEBHOOK_URL and not WEBHOOK_SECRET_TOKEN:
+        # The random token is only ever handed to Telegram by set_webhook(), so every update would be refused
+        raise SystemExit("Webhook mode without WEBHOOK_URL needs WEBHOOK_SECRET_TOKEN, the token the webhook "
+                         "was registered with")
+    if SHARD_COUNT > 1:
+        return run_sharded()
+
+    from telegram.ext import Updater
+
+    persistence = journal_persistence() if STATE_JOURNAL_PATH else None
+    dispatcher = create_app(create_bot(), persistence,
+                            metrics_sample_rate=METRICS_SAMPLE_RATE if METRICS_PORT else None)
+    updater = Updater(dispatcher=dispatcher, workers=None)
+    job_queue = updater.job_queue
+    if metrics:
+        metrics_server = MetricsServer(metrics)
+        threading.Thread(target=metrics_server.serve_forever, name="metrics", daemon=True).start()
+
+    # Start the bot
+    message_sender.start()
+    if INGESTION_MODE == "webhook":
+        webhook_server = WebhookServer(dispatcher)
+        release_updates_to(webhook_server.pool.put)
+        if WEBHOOK_URL:
+            updater.bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=webhook_server.secret_token)
+        job_queue.start()
+        try:
+            webhook_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        webhook_server.server_close()
+        job_queue.stop()
+    else:
+        if RUNTIME_MODE == "pool":
+            pool = UpdateWorkerPool(dispatcher)
+            updater.update_queue = pool  # Polling feeds the workers instead of the dispatcher thread
+            release_updates_to(pool.put)
+            pool.start()
+        updater.start_polling()
+        updater.idle()
+        if RUNTIME_MODE == "pool":
+            pool.stop()
+    close_services(persistence)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Shared fixtures: the bot module with in-memory services, driven by the benchmarks' fake Bot API."""
+import sys
+from pathlib import Path
+from queue import Queue
+
+import pytest
+from telegram.ext import Dispatcher
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+from flood import make_update  # noqa: E402
+from load_test import FakeBot, load_bot  # noqa: E402
+
+
+@pytest.fixture
+def bot_module():
+    """A fresh copy of calorie-compass.py, so module-level services never leak between tests."""
+    return load_bot()
+
+
+@pytest.fixture
+def bot():
+    return FakeBot()
+
+
+@pytest.fixture
+def services(bot_module, bot):
+    """In-memory stores, no admission control or metrics, and a sender with no rate limits."""
+    bot_module.init_services(bot, profile_db_path=None, reminder_db_path=None, weight_db_path=None, tip_db_path=None,
+                             metrics_sample_rate=None, admission_rate=None,
+                             global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+    bot_module.message_sender.start()
+    yield bot_module
+    bot_module.message_sender.stop(timeout=10)
+
+
+@pytest.fixture
+def send(services, bot):
+    """Send a user's text through the registered handlers and wait for the replies to go out."""
+    dispatcher = Dispatcher(bot, Queue(), workers=1)
+    services.register_handlers(dispatcher)
+    update_ids = iter(range(1, 1 << 62))
+
+    def send(chat_id, *texts):
+        for text in texts:
+            dispatcher.process_update(make_update(bot, next(update_ids), chat_id, text))
+        services.message_sender.join()
+
+    return send
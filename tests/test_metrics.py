@@ -0,0 +1,8 @@
+"""Instrumentation stays cheap: the cost per update of full and sampled metrics stays within budget."""
+from load_test import METRICS_OVERHEAD_BUDGET_US, metrics_overhead
+
+
+def test_metrics_overhead_per_update(bot_module):
+    overhead = metrics_overhead(bot_module, users=500, repeats=11)
+    for metrics, budget in METRICS_OVERHEAD_BUDGET_US.items():
+        assert overhead[metrics] <= budget, (metrics, overhead)
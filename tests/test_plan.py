@@ -0,0 +1,49 @@
+"""/plan gives the same profile, plan and reply as the step-by-step conversation, in every language."""
+import itertools
+from pathlib import Path
+
+import pytest
+
+from plan_command import MEASUREMENTS, scripts
+
+LANGUAGES = sorted(path.stem for path in (Path(__file__).resolve().parent.parent / "locales").glob("*.json"))
+
+
+def outcome(bot_module, bot, locale, user_id):
+    """What a user ends up with: profile values, the plan kept with the weigh-ins and the plan reply."""
+    profile = bot_module.profile_store.get(user_id)
+    series = bot_module.weight_log.get(user_id)
+    prefix = locale["diet_plan_ready"].split("{")[0]
+    replies = [text for _, chat_id, text in bot.calls if chat_id == user_id and text.startswith(prefix)]
+    return ({field: profile.get(field) for field in ("language",) + bot_module.PLAN_FIELDS},
+            (series.tdee, series.daily_calories) if series else None, replies)
+
+
+@pytest.mark.parametrize("code", LANGUAGES)
+def test_plan_matches_step_by_step(services, send, bot, code):
+    locale = services.LOCALES[code]
+    chat_ids = itertools.count(1)
+    for ways in scripts(locale, MEASUREMENTS):
+        outcomes = []
+        for texts in ways:
+            chat_id = next(chat_ids)
+            send(chat_id, *texts)
+            outcomes.append(outcome(services, bot, locale, chat_id))
+        profile, plan, replies = outcomes[0]
+        assert profile["language"] == code and plan is not None and len(replies) == 1, ways[0]
+        assert outcomes[1] == outcomes[0], ways[1]
+        assert outcomes[2] == outcomes[0], ways[2]
+
+
+@pytest.mark.parametrize("text", ["/plan", "/plan 30 m 180 80 moderate", "/plan 30 x 180 80 moderate 0.5",
+                                  "/plan 30 m 180 80 lazy 0.5", "/plan 300 m 180 80 moderate 0.5"])
+def test_plan_rejects_invalid_input(services, send, bot, text):
+    send(1, text)
+    assert [reply for _, _, reply in bot.calls] == [services.LOCALES["en"]["plan_usage"]]
+    assert services.weight_log.get(1) is None
+
+
+def test_plan_warns_about_fast_weight_loss(services, send, bot):
+    send(1, "/plan 30 m 180 80 moderate 1.5")
+    assert [reply for _, _, reply in bot.calls] == [services.LOCALES["en"]["weight_loss_goal_warning"]]
+    assert services.weight_log.get(1) is None
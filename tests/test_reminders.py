@@ -0,0 +1,83 @@
+"""Weekly progress reminders: one per chat per week, however often the chat finishes a plan."""
+import threading
+from collections import Counter
+
+USERS = 1000
+RECALCULATIONS = 3
+
+
+def schedule_users(bot_module, scheduler):
+    """Users finish their plans over one day, each several times; returns the time the last one finished."""
+    now = 0.0
+    for _ in range(RECALCULATIONS):
+        for chat_id in range(USERS):
+            now += 86400 / (USERS * RECALCULATIONS)
+            scheduler.schedule(chat_id, now=now)
+    return now
+
+
+def week_of_ticks(bot_module, scheduler, now):
+    reminded = Counter()
+    tick = now
+    while tick < now + scheduler.interval:
+        tick += bot_module.REMINDER_TICK
+        reminded.update(scheduler.pop_due(tick))
+    return reminded
+
+
+def test_each_chat_is_reminded_once_a_week(bot_module):
+    scheduler = bot_module.ReminderScheduler(None)
+    now = schedule_users(bot_module, scheduler)
+    assert len(scheduler) == USERS
+    reminded = week_of_ticks(bot_module, scheduler, now)
+    assert len(reminded) == USERS and set(reminded.values()) == {1}, Counter(reminded.values())
+    reminded = week_of_ticks(bot_module, scheduler, now + scheduler.interval)
+    assert len(reminded) == USERS and set(reminded.values()) == {1}, Counter(reminded.values())
+
+
+def test_cancelled_chats_are_not_reminded(bot_module):
+    scheduler = bot_module.ReminderScheduler(None)
+    now = schedule_users(bot_module, scheduler)
+    for chat_id in range(0, USERS, 2):
+        scheduler.cancel(chat_id)
+    assert set(week_of_ticks(bot_module, scheduler, now)) == set(range(1, USERS, 2))
+
+
+def test_missed_weeks_are_not_sent_again(bot_module):
+    scheduler = bot_module.ReminderScheduler(None)
+    scheduler.schedule(1, now=0)
+    later = 5 * scheduler.interval
+    assert scheduler.pop_due(later) == [1]
+    assert scheduler.pop_due(later) == []
+    assert scheduler.due_times() == {1: later + scheduler.interval}
+
+
+def test_due_times_survive_a_restart(bot_module, tmp_path):
+    path = str(tmp_path / "reminders.db")
+    scheduler = bot_module.ReminderScheduler(path)
+    now = schedule_users(bot_module, scheduler)
+    scheduler.pop_due(now + scheduler.interval / 2)
+    assert bot_module.ReminderScheduler(path).due_times() == scheduler.due_times()
+
+
+def test_due_reminders_go_out_behind_replies(bot_module, bot):
+    """A tick with more reminders due than the send queue holds neither blocks the job nor holds up replies."""
+    bot_module.init_services(bot, profile_db_path=None, reminder_db_path=None, weight_db_path=None, tip_db_path=None,
+                             metrics_sample_rate=None, admission_rate=None, max_size=100, global_rate=1e9)
+    for chat_id in range(1, USERS + 1):
+        bot_module.profile_store.put(chat_id, bot_module.UserProfile(language="en" if chat_id % 2 else "ru"))
+        bot_module.reminder_scheduler.schedule(chat_id, first=0, now=0)
+    job = threading.Thread(target=bot_module.send_due_reminders, args=(None,), daemon=True)
+    job.start()
+    job.join(timeout=5)
+    assert not job.is_alive(), "send_due_reminders blocked on the send queue"
+
+    bot_module.message_sender.send(0, "reply")
+    bot_module.message_sender.start()
+    bot_module.message_sender.stop(timeout=30)
+    chats = [chat_id for _, chat_id, _ in bot.calls]
+    assert chats.index(0) <= bot_module.message_sender.bulk_window
+    assert sorted(chats) == list(range(USERS + 1))
+    for _, chat_id, text in bot.calls:
+        if chat_id:
+            assert text == bot_module.LOCALES["en" if chat_id % 2 else "ru"]["progress_reminder"]
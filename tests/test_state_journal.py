@@ -0,0 +1,77 @@
+"""Conversation state journal: onboarding survives a crash, and journaled answers never undo newer profiles."""
+import json
+
+import pytest
+
+from flood import make_update
+from load_test import FakeBot
+
+ANSWERS = ["/start", "English", "30", "Male", "180", "80", "Moderately Active", "0.5"]
+PLAN = "/plan 50 f 160 60 sedentary 0.25"
+
+
+@pytest.fixture
+def run_bot(bot_module, tmp_path):
+    """Handle texts from user 1 with the state journal, then stop: cleanly, or as if killed.
+
+    With `profile_db`, profiles are kept in SQLite, which a clean stop writes out; otherwise
+    they are kept in memory and only the journal survives. Returns the bot's replies.
+    """
+    def run_bot(texts, profile_db=False, clean_stop=False, path=str(tmp_path / "conversations")):
+        bot = FakeBot()
+        persistence = bot_module.journal_persistence(path)
+        dispatcher = bot_module.create_app(bot, persistence, reminder_db_path=None, weight_db_path=None,
+                                           tip_db_path=None, metrics_sample_rate=None, admission_rate=None,
+                                           global_rate=1e9, chat_rate=1e9, chat_burst=1e9,
+                                           profile_db_path=str(tmp_path / "profiles.db") if profile_db else None)
+        bot_module.message_sender.start()
+        for update_id, text in enumerate(texts, 1):
+            dispatcher.process_update(make_update(bot, update_id, 1, text))
+        if clean_stop:
+            bot_module.close_services(persistence)
+        else:
+            bot_module.message_sender.stop()
+            persistence.flush()  # Journal records are written as they happen; only the fsync interval is skipped
+        return [text for _, _, text in bot.calls]
+
+    return run_bot
+
+
+def plan_ready(bot_module, replies):
+    return any(reply.startswith(bot_module.LOCALES["en"]["diet_plan_ready"].split("{")[0]) for reply in replies)
+
+
+def test_killed_mid_onboarding_resumes_with_the_answers(bot_module, run_bot):
+    run_bot(ANSWERS[:4])  # Killed while asked for the height, before the profile was written
+    replies = run_bot(ANSWERS[4:])
+    profile = bot_module.profile_store.get(1)
+    assert (profile.age, profile.gender) == (30, "male"), profile
+    assert plan_ready(bot_module, replies), replies
+
+
+def test_journal_without_profiles_ends_at_the_restart_prompt(bot_module, run_bot, tmp_path):
+    """A journal from before profiles were journaled: the step survives, the answers do not."""
+    path = str(tmp_path / "old")
+    with open(path + ".journal", "w", encoding="utf-8") as journal:
+        journal.write(json.dumps(["c", bot_module.CONVERSATION_NAME, [1, 1], bot_module.HEIGHT]) + "\n")
+    replies = run_bot(ANSWERS[4:], path=path)
+    assert replies[-1].startswith(bot_module.LOCALES["en"]["restart_prompt"]), replies
+    replies = run_bot(["/start"], path=path)  # And /start begins again from any step
+    assert replies == [bot_module.LOCALES["en"]["choose_language"]], replies
+
+
+@pytest.mark.parametrize("answers", [ANSWERS, ANSWERS[:4]], ids=["after onboarding", "during onboarding"])
+def test_restart_keeps_a_profile_changed_outside_the_conversation(bot_module, run_bot, answers):
+    """/plan changes the profile but no conversation state, so the journal never sees its values."""
+    replies = run_bot(answers + [PLAN], profile_db=True, clean_stop=True)
+    assert plan_ready(bot_module, replies), replies
+    run_bot([], profile_db=True)
+    profile = bot_module.profile_store.get(1)
+    assert (profile.age, profile.gender, profile.activity_level) == (50, "female", "sedentary"), profile
+
+
+def test_finished_onboarding_leaves_no_profile_in_the_journal(bot_module, run_bot, tmp_path):
+    path = str(tmp_path / "conversations")
+    run_bot(ANSWERS, path=path)
+    journal = bot_module.ConversationJournal(path)
+    assert journal.entries(bot_module.CONVERSATION_NAME) == [((1, 1), bot_module.DONE, None)]
@@ -0,0 +1,71 @@
+"""Tip rotation and the daily digest: no repeats within a cycle, and no tips for chats that are gone."""
+import pytest
+from telegram.error import BadRequest, Unauthorized
+
+from load_test import FakeBot
+
+CHATS = 1000
+CYCLES = 5
+
+
+class RejectingBot(FakeBot):
+    """FakeBot that refuses messages to some chats with the given Bot API error."""
+
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = errors
+        self.attempts = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.attempts.append(chat_id)
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        super().send_message(chat_id, text, **kwargs)
+
+
+def test_rotation_never_repeats_a_tip(bot_module):
+    """Every cycle of every chat is a permutation of the tips, and cycles never join on a repeated tip."""
+    bot_module.load_localization()
+    rotation = bot_module.TipRotation(None)
+    counts = {language: len(tips) for language, tips in bot_module.NUTRITION_TIPS.items()}
+    for chat_id in range(CHATS):
+        rotation.subscribe(chat_id, "en" if chat_id % 2 else "ru", seed=chat_id * 7919)
+    for chat_id in range(CHATS):
+        count = counts["en" if chat_id % 2 else "ru"]
+        shown = [rotation.advance(chat_id, counts)[1] for _ in range(count * CYCLES)]
+        for cycle in range(CYCLES):
+            assert sorted(shown[cycle * count:(cycle + 1) * count]) == list(range(count)), (chat_id, cycle)
+        assert all(a != b for a, b in zip(shown, shown[1:])), chat_id
+
+
+def test_digest_sends_each_subscribed_chat_one_tip(services, bot):
+    for chat_id in range(1, 101):
+        services.tip_rotation.subscribe(chat_id, "en" if chat_id % 2 else "ru")
+    services.send_tip_digest(None)
+    services.message_sender.join()
+    assert sorted(chat_id for _, chat_id, _ in bot.calls) == list(range(1, 101))
+    for _, chat_id, text in bot.calls:
+        locale = services.LOCALES["en" if chat_id % 2 else "ru"]
+        assert text.startswith(locale["nutrition_tip"])
+
+
+# Chat 1 blocked the bot and chat 2 no longer exists; chat 3 only had one message rejected
+@pytest.mark.parametrize("bot", [RejectingBot({1: Unauthorized("Forbidden: bot was blocked by the user"),
+                                               2: BadRequest("Chat not found"), 3: BadRequest("Message is too long")})],
+                         ids=["rejecting"])
+def test_unreachable_and_stopped_chats_leave_the_digest(services, send, bot):
+    chats = set(range(1, 101))
+    for chat_id in chats:
+        services.tip_rotation.subscribe(chat_id, "en")
+        services.reminder_scheduler.schedule(chat_id)
+    send(4, "/stop")
+    services.send_tip_digest(None)
+    services.message_sender.join()
+    gone = {1, 2, 4}
+    assert set(services.tip_rotation.chats()) == chats - gone
+    assert set(services.reminder_scheduler.due_times()) == chats - gone
+
+    bot.attempts.clear()
+    services.send_tip_digest(None)
+    services.message_sender.join()
+    assert sorted(bot.attempts) == sorted(chats - gone), "tips sent to unreachable chats"
@@ -0,0 +1,67 @@
+"""Webhook mode: the secret token is required, bad payloads are refused and updates reach the handlers."""
+import json
+import threading
+
+import pytest
+
+from webhook import SECRET_TOKEN, Client
+
+
+@pytest.fixture
+def server(services, bot):
+    from queue import Queue
+
+    from telegram.ext import Dispatcher
+
+    dispatcher = Dispatcher(bot, Queue(), workers=1)
+    services.register_handlers(dispatcher)
+    server = services.WebhookServer(dispatcher, listen="127.0.0.1", port=0, workers=2, secret_token=SECRET_TOKEN)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    return Client(server.server_address[1], server.path)
+
+
+def update_json(update_id, chat_id, text):
+    """An update as Telegram POSTs it."""
+    entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] if text.startswith("/") else []
+    return json.dumps({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "user"}, "text": text, "entities": entities}})
+
+
+def test_wrong_or_missing_secret_token_is_refused(server, client):
+    assert client.post(update_json(1, 1, "30"), token="wrong") == 403
+    assert client.post(update_json(1, 1, "30"), token="") == 403
+    assert client.get(server.path + "/stats")["received"] == 0
+
+
+@pytest.mark.parametrize("payload", ["not json", "[]", '{"message": 1}'])
+def test_payloads_that_are_not_updates_are_refused(client, payload):
+    assert client.post(payload) == 400
+
+
+def test_updates_reach_the_handlers(services, server, client, bot):
+    assert client.post(update_json(1, 7, "/plan 30 m 180 80 moderate 0.5")) == 200
+    server.pool.stop()  # Handles what is queued
+    services.message_sender.join()
+    assert [(chat_id, text.split("\n")[0]) for _, chat_id, text in bot.calls] == [
+        (7, services.LOCALES["en"]["diet_plan_ready"].split("\n")[0])]
+    assert client.get(server.path + "/stats")["processed"] == 1
+
+
+def test_unknown_paths_are_not_found(client):
+    client.path = "/elsewhere"
+    assert client.post(update_json(1, 1, "30")) == 404
+
+
+def test_webhook_mode_needs_a_known_secret_token(bot_module, monkeypatch):
+    monkeypatch.setattr("sys.argv", ["calorie-compass.py"])
+    bot_module.INGESTION_MODE = "webhook"
+    with pytest.raises(SystemExit, match="WEBHOOK_SECRET_TOKEN"):
+        bot_module.main()